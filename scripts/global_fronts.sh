@@ -12,8 +12,10 @@ module use /scratch2/NCEPDEV/marine/Todd.Spindler/save/modulefiles
 module load anaconda-work/1.0.0 mmab/1.0.0
 
 THE_DATE=${1:-`date --date yesterday +%Y%m%d`}
+END_DATE=${2:-}    # optional: backfill THE_DATE to END_DATE
 
 NCORES=12
+NSHARDS=${NSHARDS:-4}    # backfill array tasks (nodes)
 
 TASK_QUEUE='batch'
 WALL='0:30:00'
@@ -26,5 +28,12 @@ rm -f $LOGPATH/*.log
 
 export SRCDIR='/scratch2/NCEPDEV/marine/Todd.Spindler/save/VPPPG/Global_RTOFS/EMC_ocean-verification/fronts'
 
-job1=$(sbatch --parsable -J ${JOB}_${THE_DATE} -o $LOGPATH/${JOB}_${THE_DATE}.log -q $TASK_QUEUE --account=$PROJ --time $WALL --ntasks=$(($NCORES + 1)) --nodes=1 --wrap "python $SRCDIR/ush/global_fronts.py $THE_DATE")
+if [ -z "$END_DATE" ]; then
+    job1=$(sbatch --parsable -J ${JOB}_${THE_DATE} -o $LOGPATH/${JOB}_${THE_DATE}.log -q $TASK_QUEUE --account=$PROJ --time $WALL --ntasks=$(($NCORES + 1)) --nodes=1 --wrap "python $SRCDIR/ush/global_fronts.py $THE_DATE")
+else
+    # backfill: one array task (shard) per node, each writing its own shard
+    # database, then a merge job that folds them into global_fronts.db
+    job1=$(sbatch --parsable --array=0-$(($NSHARDS - 1)) -J ${JOB}_${THE_DATE}_${END_DATE} -o $LOGPATH/${JOB}_${THE_DATE}_${END_DATE}_%a.log -q $TASK_QUEUE --account=$PROJ --time $WALL --ntasks=$(($NCORES + 1)) --nodes=1 --wrap "python $SRCDIR/ush/global_fronts.py $THE_DATE $END_DATE")
+    job2=$(sbatch --parsable --dependency=afterany:$job1 -J ${JOB}_merge -o $LOGPATH/${JOB}_merge_${THE_DATE}_${END_DATE}.log -q $TASK_QUEUE --account=$PROJ --time $WALL --ntasks=1 --nodes=1 --wrap "python $SRCDIR/ush/global_fronts.py $THE_DATE $END_DATE --merge --shards $NSHARDS")
+fi
 
@@ -0,0 +1,494 @@
+#!/bin/env python
+"""
+Timing benchmarks for the WBC fronts decoders and metrics.
+Each benchmark builds synthetic inputs in a scratch directory, so nothing
+here needs DCOM or RTOFS data.
+
+usage: python bench_fronts.py [benchmark ...]
+"""
+
+import numpy as np
+import glob
+import os, sys
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+import read_navy                                 # local module
+import hausdorff as haus                         # local module
+import stats_db                                  # local module
+
+#----------------------------------------------------------------------------
+def timeit(func,*args,repeat=3):
+    """
+    best wall-clock time of func(*args) in seconds
+    """
+    best=np.inf
+    for n in range(repeat):
+        t0=time.perf_counter()
+        func(*args)
+        best=min(best,time.perf_counter()-t0)
+    return best
+
+#----------------------------------------------------------------------------
+def write_navoceano(filename,thedate,npoints,nlines=4,names=['LOOP CURRENT','N. WALL KUROSHIO']):
+    """
+    write a synthetic NAVOCEANO OVLY2 message with nlines LINEs of npoints each per name
+    """
+    header=['APPROVED FOR PUBLIC RELEASE','UNCLAS','FM NAVOCEANO',
+            'MSGID','NAVOCEANO','OVLY2','1','OCT','OVLY','FRONTS','-','-','-',
+            'OCEAN FEATURE ANALYSIS','-','-','-','-','-','-',f'ANALYSIS {thedate:%d%b%y}'.upper()]
+    body=[]
+    rng=np.random.default_rng(npoints)
+    for name in names:
+        body+=['TEXT','-','-','-','-','-',name]
+        for nline in range(nlines):
+            lat=rng.uniform(15,45,npoints)
+            lon=rng.uniform(-100,179,npoints)
+            body+=['LINE',str(npoints),'-','-']
+            for y,x in zip(lat,lon):
+                body+=[f'{abs(y)*100:04.0f}{"N" if y>=0 else "S"}',
+                       f'{abs(x)*100:05.0f}{"E" if x>=0 else "W"}']
+    body+=['ENDAT']
+    with open(filename,'w') as f:
+        f.write('\n'.join(header+body)+'\n')
+
+#----------------------------------------------------------------------------
+def legacy_read_navoceano(year):
+    """
+    the original list-slicing/numpy.append NAVOCEANO decoder, kept for comparison
+    """
+    front={}
+    allfiles=sorted(glob.glob(f'{read_navy.DCOMdir}/{year}*/wtxtbul/*xx.mrf'))
+    hemisphere=read_navy.hemisphere
+    for filename in allfiles:
+        with open(filename) as f:
+            contents=f.read().replace('\n','/').split('/')
+        contents=[token.strip() for token in contents if len(token.strip())>0]
+        header,body=contents[:21],contents[21:]
+        thedate=datetime.strptime(header[-1].split()[-1],'%d%b%y')
+        while len(body) > 0 and body[0] != 'ENDAT':
+            if body[0]=='ARC':
+                body=body[7:]
+                continue
+            if body[0]=='TEXT':
+                name,body=body[6],body[7:]
+                if name not in front:
+                    front[name]={}
+                if body[0]=='LINE':
+                    front[name][thedate]={'lat':np.array([]),'lon':np.array([])}
+                continue
+            if body[0]=='LINE':
+                front[name][thedate]['lat']=np.append(front[name][thedate]['lat'],np.nan)
+                front[name][thedate]['lon']=np.append(front[name][thedate]['lon'],np.nan)
+                npoints,body=int(body[1]),body[4:]
+                for npt in range(npoints):
+                    lats,lons,body=body[0],body[1],body[2:]
+                    lat=float(lats[:4])/100.*hemisphere[lats[4]]
+                    lon=float(lons[:5])/100.*hemisphere[lons[5]]
+                    if lon < -180:
+                        lon=lon%360
+                    front[name][thedate]['lat']=np.append(front[name][thedate]['lat'],lat)
+                    front[name][thedate]['lon']=np.append(front[name][thedate]['lon'],lon)
+            else:
+                break
+    return front
+
+#----------------------------------------------------------------------------
+def bench_navoceano(sizes=[1000,2000,4000],nfiles=3):
+    """
+    read_navoceano vs. the legacy decoder on synthetic multi-thousand-point *xx.mrf files
+    """
+    print('NAVOCEANO decoder (points per LINE, 4 LINEs x 2 fronts x',nfiles,'files)')
+    dcomdir,cachedir=read_navy.DCOMdir,read_navy.cacheDir
+    try:
+        # no message cache, so the decoder is what's timed (and nothing lands in fix/)
+        read_navy.cacheDir=None
+        for npoints in sizes:
+            with tempfile.TemporaryDirectory() as tmpdir:
+                read_navy.DCOMdir=tmpdir
+                for n in range(nfiles):
+                    thedate=datetime(2021,1,1)+timedelta(n)
+                    os.makedirs(f'{tmpdir}/{thedate:%Y%m%d}/wtxtbul')
+                    write_navoceano(f'{tmpdir}/{thedate:%Y%m%d}/wtxtbul/{n:03n}xx.mrf',thedate,npoints)
+                new=read_navy.read_navoceano('2021')
+                old=legacy_read_navoceano('2021')
+                for name in old:
+                    for thedate in old[name]:
+                        for key in ['lat','lon']:
+                            np.testing.assert_allclose(new[name][thedate][key],old[name][thedate][key])
+                t_new=timeit(read_navy.read_navoceano,'2021')
+                t_old=timeit(legacy_read_navoceano,'2021',repeat=1)
+                
+                # and with a warm message cache in the scratch directory
+                read_navy.cacheDir=tmpdir
+                read_navy.read_navoceano('2021')
+                t_cache=timeit(read_navy.read_navoceano,'2021')
+                read_navy.cacheDir=None
+            print(f'  {npoints:>7n} pts  legacy {t_old:8.3f} s  new {t_new:8.3f} s  speedup {t_old/t_new:6.1f}x  cached {t_cache:8.3f} s')
+    finally:
+        read_navy.DCOMdir,read_navy.cacheDir=dcomdir,cachedir
+
+#----------------------------------------------------------------------------
+def make_front(npoints,seed=0,offset=0.):
+    """
+    synthetic meandering front of npoints (lon,lat) points, Gulf Stream-like
+    """
+    rng=np.random.default_rng(seed)
+    lon=np.linspace(280,320,npoints)
+    lat=35+3*np.sin((lon-280)/6.)+np.cumsum(rng.normal(0,0.02,npoints))+offset
+    return np.stack((lon,lat)).T
+
+def legacy_compute_dist(A,B):
+    """
+    the original per-point loop version of hausdorff.compute_dist
+    """
+    N=B.shape[0]
+    dist=[]
+    for K in range(A.shape[0]):
+        C=np.ones((N,1)) * A[K,]
+        D=(C-B)*(C-B)
+        dist.append(D.min())
+    return max(dist)
+
+#----------------------------------------------------------------------------
+def bench_hausdorff(sizes=[1000,10000,100000],legacy_max=10000):
+    """
+    classic Hausdorff: legacy loop vs. sorted-axis search, plus the Euclidean KD-tree 
+    and early-break backends.  The legacy loop is skipped above legacy_max points.
+    """
+    print('Classic Hausdorff (points per front)')
+    for npoints in sizes:
+        A=make_front(npoints,seed=1)
+        B=make_front(npoints,seed=2,offset=0.3)
+        t_classic=timeit(haus.hausdorff,A,B)
+        t_kdtree=timeit(haus.hausdorff,A,B,'kdtree')
+        t_early=timeit(haus.hausdorff,A,B,'early_break')
+        line=f'  {npoints:>7n} pts  classic {t_classic:8.4f} s  kdtree {t_kdtree:8.4f} s  early_break {t_early:8.4f} s'
+        if npoints <= legacy_max:
+            legacy=lambda A,B: max(legacy_compute_dist(A,B),legacy_compute_dist(B,A))
+            assert legacy(A,B)==haus.hausdorff(A,B)
+            t_legacy=timeit(legacy,A,B,repeat=1)
+            line+=f'  legacy {t_legacy:8.4f} s ({t_legacy/t_classic:.0f}x)'
+        print(line)
+
+#----------------------------------------------------------------------------
+def peakmem(func,*args):
+    """
+    peak traced (numpy) memory of func(*args) in MB
+    """
+    tracemalloc.start()
+    func(*args)
+    peak=tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak/2**20
+
+def bench_metrics(sizes=[1000,3000,6000]):
+    """
+    the three separate metric calls vs. hausdorff.front_metrics
+    """
+    def separate(A,B):
+        return (haus.hausdorff(A,B),haus.mod_hausdorff(A,B),haus.quantile_hausdorff(A,B))
+    print('All three metrics (points per front)')
+    for npoints in sizes:
+        A=make_front(npoints,seed=1)
+        B=make_front(npoints,seed=2,offset=0.3)
+        t_old,t_new=timeit(separate,A,B),timeit(haus.front_metrics,A,B)
+        m_old,m_new=peakmem(separate,A,B),peakmem(haus.front_metrics,A,B)
+        print(f'  {npoints:>7n} pts  separate {t_old:8.4f} s {m_old:8.1f} MB  '+
+              f'front_metrics {t_new:8.4f} s {m_new:8.1f} MB  speedup {t_old/t_new:5.1f}x')
+
+#----------------------------------------------------------------------------
+def bench_geodesic(sizes=[1000,3000,6000]):
+    """
+    degree-space cdist metrics vs. geodesic (km) front_metrics
+    """
+    def cdist_path(A,B):
+        return (haus.mod_hausdorff(A,B),haus.quantile_hausdorff(A,B))
+    print('Geodesic metrics (points per front)')
+    for npoints in sizes:
+        A=make_front(npoints,seed=1)
+        B=make_front(npoints,seed=2,offset=0.3)
+        t_cdist=timeit(cdist_path,A,B)
+        t_geo=timeit(haus.front_metrics,A,B,0.75,[],True)
+        print(f'  {npoints:>7n} pts  cdist (degrees) {t_cdist:8.4f} s  geodesic (km) {t_geo:8.4f} s')
+
+#----------------------------------------------------------------------------
+def bench_contour(sizes=[(300,400),(600,800),(1200,1600)]):
+    """
+    plt.contour + allsegs vs. front_contour.extract_front on a synthetic isotherm field
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from front_contour import extract_front
+    def pyplot_front(lon,lat,temp):
+        CS=plt.contour(lon,lat,temp,[12])
+        [segs]=CS.allsegs
+        seglen=np.array([s.shape[0] for s in segs])
+        i=np.argsort(seglen).tolist()
+        i.reverse()
+        plt.close()
+        return segs[i[0]]
+    print('Front contour extraction (grid size)')
+    rng=np.random.default_rng(0)
+    for ny,nx in sizes:
+        lon,lat=np.meshgrid(np.linspace(275,320,nx),np.linspace(20,50,ny))
+        temp=np.ma.masked_invalid(30-0.5*(lat-10)+2*np.sin(np.radians(lon)*12)+rng.normal(0,0.3,lat.shape))
+        assert np.array_equal(pyplot_front(lon,lat,temp),extract_front(lon,lat,temp,12))
+        t_old=timeit(pyplot_front,lon,lat,temp)
+        t_new=timeit(extract_front,lon,lat,temp,12)
+        print(f'  {ny:>5n}x{nx:<5n}  plt.contour {t_old:8.4f} s  extract_front {t_new:8.4f} s  speedup {t_old/t_new:5.1f}x')
+
+#----------------------------------------------------------------------------
+def bench_resample(sizes=[1000,10000,100000],spacing=10.):
+    """
+    geodesic front_metrics with and without resampling to spacing km, against
+    a 300-point Navy-like front
+    """
+    print(f'Resampled metrics ({spacing:n} km spacing, points in model front)')
+    B=make_front(300,seed=2,offset=0.3)
+    for npoints in sizes:
+        A=make_front(npoints,seed=1)
+        def resampled(A,B):
+            return haus.front_metrics(haus.resample_front(A,spacing,geodesic=True),
+                                      haus.resample_front(B,spacing,geodesic=True),geodesic=True)
+        raw,res=haus.front_metrics(A,B,geodesic=True),resampled(A,B)
+        t_raw,t_res=timeit(haus.front_metrics,A,B,0.75,[],True),timeit(resampled,A,B)
+        delta=' '.join([f'{key} {res[key]-raw[key]:+6.2f}' for key in raw])
+        print(f'  {npoints:>7n} pts  raw {t_raw:8.4f} s  resampled {t_res:8.4f} s  change (km): {delta}')
+
+#----------------------------------------------------------------------------
+def bench_plot_map(sizes=[(100,150),(200,300)],repeat=3):
+    """
+    plot_map with a new base map for every image vs. the reused per-region
+    base map.  Needs the cartopy coastline data, like the real maps.
+    """
+    import global_fronts as gf
+    import matplotlib.pyplot as plt
+    print('Region maps (grid size, seconds per image)')
+    region=gf.load_regions()['gulfstream']
+    vdate=datetime(2021,1,12)
+    navy={key:{vdate:{'lon':np.linspace(-80,-50,100),'lat':np.linspace(32,40,100)+offset}}
+          for key,offset in [('GULF STREAM NORTH WALL',1.),('GULF STREAM SOUTH WALL',-1.)]}
+    result={'metrics':{'modhaus_navy':1.,'quanthaus_navy':2.}}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        gf.imageDir,gf.logoDir=tmpdir,tmpdir
+        os.makedirs(f'{tmpdir}/{vdate:%Y%m%d}')
+        for name in ['NOAA','NWS']:
+            plt.imsave(f'{tmpdir}/{name}_logo.png',np.ones((60,60,3)))
+        for ny,nx in sizes:
+            lon,lat=np.meshgrid(np.linspace(275,320,nx),np.linspace(20,50,ny))
+            temp=np.ma.masked_invalid(30-0.5*(lat-10)+2*np.sin(np.radians(lon)*12))
+            x,y=gf.project_grid(lon,lat)
+            model={'lon':lon,'lat':lat,'x':x,'y':y,'sst':temp,'ssh':np.sin(np.radians(lon)*8)*np.cos(np.radians(lat)*8),
+                   'current':np.hypot(np.sin(lat),np.cos(lon)),'u':np.sin(lat),'v':np.cos(lon),
+                   'vdate':vdate,'rundate':vdate,'fcst':0}
+            result['isotherm']=temp
+            def images(cold):
+                for param in ['sst','ssh','current']:
+                    if cold:
+                        plt.close('all')
+                        gf.base_maps.clear()
+                        gf.logos.clear()
+                    gf.plot_map(model,param,navy,region,result)
+            t_old=timeit(images,True,repeat=repeat)/3
+            t_new=timeit(images,False,repeat=repeat)/3
+            plt.close('all')
+            gf.base_maps.clear()
+            print(f'  {ny:>5n}x{nx:<5n}  new figure {t_old:8.3f} s  base map {t_new:8.3f} s  speedup {t_old/t_new:5.1f}x')
+
+#----------------------------------------------------------------------------
+def check_empty_wall():
+    """
+    a NAVO bulletin with no north-wall points: only the Gulf Stream is
+    skipped, and navy_clipmask returns None for the empty front
+    """
+    import global_fronts as gf
+    print('Empty Navy wall (not a benchmark)')
+    regions=gf.load_regions()
+    thedate=datetime(2021,1,12)
+    walls=read_navy.parse_walls({read_navy.southname:[['35.2N74.9W','36.0N70.0W','36.5N65.1W']]})
+    assert len(walls[read_navy.northname]['lat'])==0
+    front={'lat':np.array([25.,27.]),'lon':np.array([-88.,-85.])}
+    navies={reg:{region['name'].upper():{thedate:front}} for reg,region in regions.items()}
+    navies['gulfstream']={name:{thedate:wall} for name,wall in walls.items()}
+    active=gf.active_regions(regions,navies,thedate)
+    assert sorted(active)==sorted([reg for reg in regions if reg!='gulfstream'])
+    lon,lat=np.meshgrid(np.linspace(275,320,10),np.linspace(20,50,8))
+    assert gf.navy_clipmask(lon,lat,walls[read_navy.northname]) is None
+    assert gf.navy_clipmask(lon,lat,front).shape==lon.shape
+    print('  active regions',sorted(active))
+
+#----------------------------------------------------------------------------
+def bench_handoff(sizes=[(500,700),(1000,1400),(2000,2800)]):
+    """
+    pickling a region's plot fields (what a Pool result costs) vs. the
+    shared_fields block the compute pool hands to the render pool
+    """
+    import pickle
+    import shared_fields
+    print('Compute -> render hand-off (grid size)')
+    rng=np.random.default_rng(0)
+    for ny,nx in sizes:
+        mask=rng.random((ny,nx))<0.2
+        arrays={key:np.ma.array(rng.random((ny,nx)),mask=mask,copy=False) for key in ['lon','lat','x','y']}
+        arrays.update({key:np.ma.array(rng.random((ny,nx)).astype(np.float32),mask=mask,copy=False)
+                       for key in ['sst','ssh','u','v','current','isotherm']})
+        def pickled():
+            return pickle.loads(pickle.dumps(arrays,protocol=pickle.HIGHEST_PROTOCOL))
+        def shared():
+            with shared_fields.attached(shared_fields.share(arrays)) as (fields,meta):
+                return len(fields)
+        t_old=timeit(pickled)
+        t_new=timeit(shared)
+        print(f'  {ny:>5n}x{nx:<5n}  pickle {t_old:8.4f} s  shared memory {t_new:8.4f} s  speedup {t_old/t_new:5.1f}x')
+
+#----------------------------------------------------------------------------
+def sleep_job(seconds):
+    time.sleep(seconds)
+    return seconds
+
+def bench_scheduler(workers=[1,3,9],njobs=27,seconds=0.2):
+    """
+    Scheduler throughput vs. the number of pool workers, on jobs that only
+    wait (like a forecast job waiting on its model files)
+    """
+    from multiprocessing import Pool
+    from scheduler import Scheduler
+    print(f'Scheduler ({njobs} jobs of {seconds:n} s)')
+    for nworkers in workers:
+        with Pool(nworkers) as pool:
+            def sweep():
+                jobs=Scheduler(pool)
+                for n in range(njobs):
+                    jobs.submit(n,sleep_job,(seconds,))
+                assert not jobs.wait()
+            t=timeit(sweep,repeat=1)
+        print(f'  {nworkers:>3n} workers  {t:8.3f} s  ({njobs/t:6.1f} jobs/s, ideal {nworkers/seconds:6.1f})')
+
+#----------------------------------------------------------------------------
+def bench_front_store(ndates=[30,120],npoints=300):
+    """
+    writing, compacting and loading the front store, and re-scoring from it
+    (one part per date, forecast and region, as the compute jobs write them)
+    """
+    import front_store
+    print(f'Front store ({npoints}-point fronts, 9 forecasts x 4 regions per date)')
+    regions=['gulfstream','loopcurrent','kuroshio','azores']
+    for n in ndates:
+        dates=[datetime(2020,12,1)+timedelta(d) for d in range(n)]
+        navy={(d,reg):make_front(npoints,seed=k) for k,(d,reg) in enumerate([(d,reg) for d in dates for reg in regions])}
+        with tempfile.TemporaryDirectory() as tmpdir:
+            def write():
+                for (d,reg),navy_front in navy.items():
+                    for fcst in range(0,193,24):
+                        front_store.write_part(tmpdir,f'{d:%Y%m%d}_{fcst:03n}_{reg}',
+                                               [(d,reg,fcst,'model',navy_front+fcst/100.),
+                                                (d,reg,front_store.NAVY_FORECAST,'navy',navy_front)])
+            t_write=timeit(write,repeat=1)
+            t_compact=timeit(front_store.compact,tmpdir,repeat=1)
+            size=sum([os.path.getsize(f) for f in glob.glob(tmpdir+'/*.npz')])
+            t_load=timeit(front_store.load,tmpdir)
+            store=front_store.load(tmpdir)
+            def metrics(A,B):
+                return haus.front_metrics(A.astype(float),B.astype(float))
+            t_rescore=timeit(front_store.rescore,store,metrics,repeat=1)
+            scores=front_store.rescore(store,metrics)
+            # float32 coordinates against the original float64 fronts
+            d,reg=dates[-1],regions[-1]
+            exact=haus.front_metrics(navy[(d,reg)]+1.92,navy[(d,reg)])['haus']
+            error=abs(scores[(scores.date==d)&(scores.region==reg)&(scores.forecast==192)]['haus'].values[0]-exact)
+        print(f'  {n:>4n} dates  {len(scores):>5n} scores  write {t_write:7.3f} s  compact {t_compact:7.3f} s  '
+              f'{size/2**20:6.1f} MB  load {t_load:7.3f} s  rescore {t_rescore:7.3f} s  (float32 error {error:.1e} deg)')
+
+#----------------------------------------------------------------------------
+def bench_model_cache(sizes=[(500,700),(1000,1400)],nentries=12):
+    """
+    writing and reading a region's model subset in the model cache, and the
+    size cap (cap set to half of nentries entries)
+    """
+    import model_cache
+    print('Model cache (grid size)')
+    rng=np.random.default_rng(0)
+    for ny,nx in sizes:
+        lon,lat=np.meshgrid(np.linspace(275,320,nx),np.linspace(20,50,ny))
+        mask=rng.random((ny,nx))<0.2
+        model={'lon':lon,'lat':lat,'x':lon*1e5,'y':lat*1e5,'vdate':datetime(2021,1,12),'fcst':24,
+               'rundate':datetime(2021,1,11)}
+        for key in model_cache.fields:
+            field=(20+np.sin(lon/3.)*np.cos(lat/2.)+rng.normal(0,0.01,(ny,nx))).astype(np.float32)
+            model[key]=np.ma.array(field,mask=mask,copy=False)
+        model['temp']=np.ma.masked_where(lat>40,model['temp'].data)
+        raw=sum([np.asarray(model[key]).nbytes for key in model_cache.coords+model_cache.fields])
+        with tempfile.TemporaryDirectory() as tmpdir:
+            t_write=timeit(model_cache.write,tmpdir,'gulfstream',model)
+            t_read=timeit(model_cache.read,tmpdir,'gulfstream',model['rundate'],model['fcst'])
+            size=os.path.getsize(model_cache.cache_file(tmpdir,'gulfstream',model['rundate'],model['fcst']))
+            cached=model_cache.read(tmpdir,'gulfstream',model['rundate'],model['fcst'])
+            assert all([np.array_equal(np.ma.getmaskarray(cached[key]),np.ma.getmaskarray(model[key])) for key in model_cache.fields])
+            for n in range(nentries):
+                model['rundate']=datetime(2021,1,1)+timedelta(n)
+                model_cache.write(tmpdir,'gulfstream',model,maxmb=nentries/2*size/2**20)
+            kept=len(model_cache.entries(tmpdir))
+        print(f'  {ny:>5n}x{nx:<5n}  {size/2**20:6.1f} MB ({raw/2**20:6.1f} MB in memory)  '
+              f'write {t_write:7.3f} s  read {t_read:7.3f} s  {kept} of {nentries} entries kept under the cap')
+
+#----------------------------------------------------------------------------
+def legacy_update_db(dbfile,table,row):
+    """
+    the original one-connection-per-row update_db path
+    """
+    conn=sqlite3.connect(dbfile,detect_types=sqlite3.PARSE_DECLTYPES,timeout=30.0)
+    conn.execute('CREATE TABLE IF NOT EXISTS '+table+' (date timestamp, forecast int,'+
+                 ''.join([f' {col} real,' for col in stats_db.metric_columns])+' unique(date,forecast))')
+    conn.commit()
+    conn.close()
+    conn=sqlite3.connect(dbfile,detect_types=sqlite3.PARSE_DECLTYPES,timeout=30.0)
+    conn.execute('REPLACE INTO '+table+' VALUES ('+','.join(['?']*len(row))+')',row)
+    conn.commit()
+    conn.close()
+
+def bench_stats_db(nrows=10000):
+    """
+    per-row update_db vs. the batched single writer process
+    """
+    print(f'Stats database ({nrows} inserts over 3 tables)')
+    metrics={col:1.0 for col in stats_db.metric_columns}
+    rows=[(['gulfstream','loopcurrent','kuroshio'][n%3],
+           stats_db.make_row(datetime(2000,1,1)+timedelta(n//27),(n//3)%9*24,metrics)) for n in range(nrows)]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        def legacy():
+            for table,row in rows:
+                legacy_update_db(f'{tmpdir}/legacy.db',table,row)
+        def writer():
+            process,queue=stats_db.start_writer(f'{tmpdir}/writer.db')
+            for item in rows:
+                queue.put(item)
+            stats_db.stop_writer(process,queue)
+        t_old=timeit(legacy,repeat=1)
+        t_new=timeit(writer,repeat=1)
+        count=sqlite3.connect(f'{tmpdir}/writer.db').execute('SELECT count(*) FROM gulfstream').fetchone()[0]
+        assert count==len([r for r in rows if r[0]=='gulfstream'])
+    print(f'  per-row {t_old:8.3f} s ({nrows/t_old:8.0f} rows/s)  writer {t_new:8.3f} s ({nrows/t_new:8.0f} rows/s)  speedup {t_old/t_new:5.1f}x')
+
+#----------------------------------------------------------------------------
+benchmarks={'navoceano':bench_navoceano,
+            'hausdorff':bench_hausdorff,
+            'metrics':bench_metrics,
+            'geodesic':bench_geodesic,
+            'contour':bench_contour,
+            'resample':bench_resample,
+            'plot_map':bench_plot_map,
+            'empty_wall':check_empty_wall,
+            'handoff':bench_handoff,
+            'scheduler':bench_scheduler,
+            'fronts':bench_front_store,
+            'model_cache':bench_model_cache,
+            'stats_db':bench_stats_db}
+
+if __name__ == '__main__':
+
+    for name in sys.argv[1:] or list(benchmarks.keys()):
+        benchmarks[name]()
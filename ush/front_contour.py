@@ -0,0 +1,36 @@
+"""
+Headless front extraction for the WBC fronts metrics.
+Runs marching squares directly through contourpy (the contouring engine
+that matplotlib ships), so it is safe in worker processes and threads
+and never touches pyplot state.
+"""
+
+import numpy as np
+import numpy.ma as ma
+import contourpy
+
+#----------------------------------------------------------------------------
+def contour_segments(lon,lat,field,level):
+    """
+    All segments of the level contour of a (masked) 2-D field, as a list of
+    (N,2) lon/lat arrays, the same segments plt.contour gives in allsegs
+    """
+    gen=contourpy.contour_generator(lon,lat,ma.masked_invalid(field),
+                                    name='mpl2014',corner_mask=True,
+                                    line_type=contourpy.LineType.SeparateCode)
+    segs,codes=gen.lines(level)
+    return segs
+
+#----------------------------------------------------------------------------
+def extract_front(lon,lat,field,level):
+    """
+    The longest segment of the level contour as an (N,2) lon/lat array, or
+    an empty (0,2) array if there is no contour.  Selecting the longest 
+    segment removes closed eddies.
+    """
+    segs=contour_segments(lon,lat,field,level)
+    if len(segs)==0:
+        return np.empty((0,2))
+    seglen=np.array([s.shape[0] for s in segs])
+    i=np.argsort(seglen,kind='stable')
+    return segs[i[-1]]  # the longest segment is (hopefully) the main front
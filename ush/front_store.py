@@ -0,0 +1,192 @@
+"""
+Columnar store of the model and Navy front polylines, so the metrics can be
+recomputed over the whole history without rereading RTOFS.
+
+A store holds M fronts as one (N,2) float32 lon/lat array (coords) plus
+offsets (M+1), with front i at coords[offsets[i]:offsets[i+1]], and one
+entry per front in the index columns date, region, forecast and source
+('model' or 'navy'; Navy fronts don't depend on the forecast and are kept
+once per date with forecast -1).  NaN rows are segment breaks, as in the
+Navy fronts.
+
+Each compute job writes its fronts as a small part file (written
+atomically, and rewritten if the job is redone), and compact() folds the
+parts into one store file per year, fronts_YYYY.npz, holding a lock file
+so overlapping runs don't lose each other's fronts.  load() reads the
+yearly files and any parts not yet compacted.
+"""
+
+import fcntl
+import glob
+import os
+import numpy as np
+import pandas as pd
+
+columns=['date','region','forecast','source']
+NAVY_FORECAST=-1  # forecast of the Navy fronts
+
+#-----------------------------------------------
+# build and save
+#-----------------------------------------------
+def make_store(records):
+    """
+    store dict from a list of (date,region,forecast,source,front) records
+    """
+    lines=[np.asarray(line,dtype=np.float32).reshape(-1,2) for *key,line in records]
+    lengths=np.array([len(line) for line in lines],dtype=np.int64)
+    return {'date':np.array([key[0] for key in records],dtype='datetime64[s]'),
+            'region':np.array([key[1] for key in records],dtype='U16'),
+            'forecast':np.array([key[2] for key in records],dtype=np.int16),
+            'source':np.array([key[3] for key in records],dtype='U8'),
+            'offsets':np.concatenate(([0],np.cumsum(lengths))),
+            'coords':np.concatenate(lines) if lines else np.zeros((0,2),dtype=np.float32)}
+
+def save_store(filename,store):
+    """
+    write a store atomically
+    """
+    tmpfile=f'{filename}.{os.getpid()}.tmp'  # not matched by the part_*.npz and fronts_*.npz globs
+    with open(tmpfile,'wb') as f:
+        np.savez(f,**store)
+    os.replace(tmpfile,filename)
+
+def write_part(storedir,name,records):
+    """
+    save the records of one job as storedir/part_<name>.npz
+    """
+    os.makedirs(storedir,exist_ok=True)
+    save_store(f'{storedir}/part_{name}.npz',make_store(records))
+
+#-----------------------------------------------
+# read
+#-----------------------------------------------
+def read_store(filename):
+    with np.load(filename) as npz:
+        return {key:npz[key] for key in npz.files}
+
+def concat(stores):
+    """
+    one store from a list of stores, later stores winning on duplicate keys,
+    sorted by date, region, forecast and source
+    """
+    stores=[store for store in stores if len(store['date'])>0]
+    if not stores:
+        return make_store([])
+    # everything end to end, with the offsets shifted into the joined coords
+    bases=np.cumsum([0]+[len(store['coords']) for store in stores])
+    whole={col:np.concatenate([store[col] for store in stores]) for col in columns}
+    whole['offsets']=np.concatenate([store['offsets'][:-1]+base for store,base in zip(stores,bases)]+[bases[-1:]])
+    whole['coords']=np.concatenate([store['coords'] for store in stores])
+
+    # then keep the last front of each key, in key order
+    index=pd.DataFrame({col:whole[col] for col in columns})
+    index['n']=np.arange(len(index))
+    index=index.drop_duplicates(columns,keep='last').sort_values(columns)
+    return subset(whole,index['n'].values)
+
+def load(storedir,start=None,end=None,regions=None,sources=None):
+    """
+    the fronts of storedir (yearly files and uncompacted parts), optionally
+    for start <= date <= end, a list of regions and a list of sources
+    """
+    files=sorted(glob.glob(f'{storedir}/fronts_*.npz'))
+    if start is not None or end is not None:
+        first=pd.Timestamp(start).year if start is not None else 0
+        last=pd.Timestamp(end).year if end is not None else 9999
+        files=[f for f in files if first <= int(os.path.basename(f)[7:11]) <= last]
+    files+=sorted(glob.glob(f'{storedir}/part_*.npz'))
+    store=concat([read_store(f) for f in files])
+
+    keep=np.ones(len(store['date']),dtype=bool)
+    if start is not None:
+        keep&=store['date']>=np.datetime64(pd.Timestamp(start),'s')
+    if end is not None:
+        keep&=store['date']<=np.datetime64(pd.Timestamp(end),'s')
+    if regions is not None:
+        keep&=np.isin(store['region'],regions)
+    if sources is not None:
+        keep&=np.isin(store['source'],sources)
+    return store if keep.all() else subset(store,np.flatnonzero(keep))
+
+def subset(store,indices):
+    """
+    the store of the fronts at the given indices
+    """
+    indices=np.asarray(indices,dtype=np.int64)
+    part={col:store[col][indices] for col in columns}
+    lengths=store['offsets'][indices+1]-store['offsets'][indices]
+    part['offsets']=np.concatenate(([0],np.cumsum(lengths)))
+    gather=np.repeat(store['offsets'][indices]-part['offsets'][:-1],lengths)+np.arange(part['offsets'][-1])
+    part['coords']=store['coords'][gather]
+    return part
+
+def front(store,i):
+    """
+    (N,2) lon/lat of front i (a view of the coords)
+    """
+    return store['coords'][store['offsets'][i]:store['offsets'][i+1]]
+
+def index(store):
+    """
+    the index columns as a DataFrame, one row per front
+    """
+    return pd.DataFrame({col:store[col] for col in columns})
+
+#-----------------------------------------------
+# compaction
+#-----------------------------------------------
+def compact(storedir):
+    """
+    fold the part files into the yearly files, then remove them.  Runs
+    sharing storedir take turns through a lock file, so a yearly file is
+    never rewritten by two of them at once.
+    """
+    if not glob.glob(f'{storedir}/part_*.npz'):
+        return
+    with open(f'{storedir}/.compact.lock','w') as lock:
+        fcntl.flock(lock,fcntl.LOCK_EX)
+        # another run may have folded some of them in while we waited
+        parts=sorted(glob.glob(f'{storedir}/part_*.npz'))
+        if not parts:
+            return
+        inodes=[os.stat(part).st_ino for part in parts]
+        stores=[read_store(part) for part in parts]
+        years=sorted(set([int(year) for store in stores for year in store['date'].astype('datetime64[Y]').astype(int)+1970]))
+        for year in years:
+            yearfile=f'{storedir}/fronts_{year}.npz'
+            inyear=[subset(store,np.flatnonzero(store['date'].astype('datetime64[Y]').astype(int)+1970==year))
+                    for store in stores]
+            previous=[read_store(yearfile)] if os.path.exists(yearfile) else []
+            save_store(yearfile,concat(previous+inyear))
+        for part,inode in zip(parts,inodes):
+            try:
+                # a part rewritten by a redone job since we read it stays for next time
+                if os.stat(part).st_ino==inode:
+                    os.remove(part)
+            except FileNotFoundError:
+                pass
+
+#-----------------------------------------------
+# re-scoring
+#-----------------------------------------------
+def pairs(store,regions=None):
+    """
+    yields (date,region,forecast,model_front,navy_front) for every model
+    front with a Navy front on the same date
+    """
+    navy={(date,region):i for i,(date,region,source) in
+          enumerate(zip(store['date'],store['region'],store['source'])) if source=='navy'}
+    for i in np.flatnonzero(store['source']=='model'):
+        key=(store['date'][i],store['region'][i])
+        if key in navy and (regions is None or key[1] in regions):
+            yield (pd.Timestamp(key[0]).to_pydatetime(),str(key[1]),int(store['forecast'][i]),
+                   front(store,i),front(store,navy[key]))
+
+def rescore(store,metrics,regions=None):
+    """
+    DataFrame of date, region, forecast and the dict returned by
+    metrics(model_front,navy_front), for every pair in the store
+    """
+    rows=[dict(date=date,region=region,forecast=fcst,**metrics(model_front,navy_front))
+          for date,region,fcst,model_front,navy_front in pairs(store,regions)]
+    return pd.DataFrame(rows)
@@ -20,6 +20,7 @@ import numpy as np
 import numpy.ma as ma
 import matplotlib.image as image
 import matplotlib.colors as colors
+import matplotlib.colorbar as colorbar
 from matplotlib.dates import MonthLocator, DateFormatter, DayLocator
 from matplotlib.dates import WeekdayLocator, MO, TU, WE, TH, FR, SA, SU
 from cartopy import crs
@@ -27,31 +28,66 @@ import xarray as xr
 from datetime import datetime, timedelta
 import seawater
 import subprocess
-import sqlite3
 import pandas as pd
 from multiprocessing import Pool
 import io
 import os, sys
+import argparse
+import hashlib
+import resource
+import traceback
 import warnings
 from read_navy import read_navo, read_navoceano  # local module
 import hausdorff as haus                         # local module
+from front_contour import extract_front          # local module
+import stats_db                                  # local module
+import front_store                               # local module
+import model_cache                               # local module
+import shared_fields                             # local module
+from scheduler import Scheduler                  # local module
 
 warnings.filterwarnings("ignore")
 
 # global parameters 
 imageDir='/scratch2/NCEPDEV/stmp1/Todd.Spindler/images/class-4/fronts'
 dbFile='/scratch2/NCEPDEV/marine/Todd.Spindler/save/VPPPG/Global_RTOFS/EMC_ocean-verification/fronts/fix/global_fronts.db'
+logoDir='/scratch2/NCEPDEV/marine/Todd.Spindler/save/Logos'
+gridFile=os.path.dirname(dbFile)+'/rtofs_grid_index.npz'  # regional grid windows, rebuilt as needed
+shardDir=os.path.dirname(dbFile)+'/shards'  # per-shard stats databases of a sharded run
+frontDir=os.path.dirname(dbFile)+'/fronts'  # front geometry store, see front_store
+cacheDir=os.path.dirname(dbFile)+'/model_cache'  # regional model subsets, see model_cache
+archiveDir='/scratch2/NCEPDEV/marine/Todd.Spindler/noscrub/Global/archive'  # RTOFS archive, one directory per run date
 modelDir=[]
+grid_index={}  # in-memory copy of gridFile
+stats_queue=None  # stats writer queue, inherited by the pool workers
+logos={}       # logo images, see add_mmab_logos
+base_maps={}   # per-region base map figures, see base_map
+navy_fronts={}  # {reg:navy} for the pool tasks, inherited by the workers
+plotFields=['lon','lat','x','y','sst','ssh','u','v','current']  # model fields the maps use
+mapParams=['sst','ssh','current']  # the maps of each region and forecast
+mapProj=crs.Mercator()  # map projection, the grid index keeps each region's grid projected to it
 
 # set to old matplotlib defaults
 plt.style.use('classic')
 
 # task settings
 maxjobs=11            # Number of parallel tasks (python multiprocessing)
+renderjobs=4          # Number of parallel map renderers, fed by the maxjobs compute tasks
+FORECASTS=range(0,193,24)  # forecast hours to verify (0 is the nowcast)
+RETRIES=2             # resubmit jobs that fail with I/O errors this many times (WANT_POOL)
+RETRY_DELAY=60        # seconds before a retry
+JOB_TIMEOUT=3600      # seconds before a job whose worker hung or died is failed (and retried)
+WANT_MAPS=True        # False for metrics-only runs (no region maps)
 WANT_POOL=True        # True will turn on parallel processing
 UPDATE_DB=True        # Update the accumulated stats database
+WANT_FRONTS=True      # Keep the model and Navy fronts in frontDir, for re-scoring without model I/O
+CACHE_MODELS=False    # Keep each region's model subset in cacheDir, and read it from there when rerun
+CACHE_MB=20000        # size cap of cacheDir in MB, least recently used subsets are removed first
 WANT_STATS_PLOTS=True # Read the stats database and plot timeseries 
 QUANTILE=0.75         # setting for Quantile Hausdorff
+MEMORY_BUDGET=None    # per-worker address space limit in MB, well above the peak address space printed per task (None for no limit)
+RESAMPLE_KM=None      # resample both fronts to this spacing in km before the metrics (None to skip)
+RESAMPLE_POINTS=None  # or to this many points per front, not both (see hausdorff.resample_front)
 
 # scale the colormap for nonsymmetric colorbars
 class MidpointNormalize(colors.Normalize):
@@ -72,51 +108,21 @@ class MidpointNormalize(colors.Normalize):
                result = result[0]
           return result
 
-#------------------------
-# initialize the database
-#------------------------
-def init_db(dbfile,table):
-        
-    # connect to db file
-    conn = sqlite3.connect(dbfile,detect_types=sqlite3.PARSE_DECLTYPES,timeout=30.0)
-    c = conn.cursor()    
-    
-    # Create table if needed
-    c.execute(
-        'CREATE TABLE IF NOT EXISTS '+table+' (date timestamp,'\
-                                           + ' forecast int,'\
-                                           + ' haus_navy real,'\
-                                           + ' modhaus_navy real,'\
-                                           + ' quanthaus_navy real,'\
-                                           + ' unique(date,forecast))')
-                                  
-    # Save (commit) the changes
-    conn.commit()
-                 
-    # close the connection
-    conn.close()
-
 #-----------------------------------------------
 # update the database                           
+#   rows go to the single stats writer process when one is running,
+#   otherwise they are written directly
 #-----------------------------------------------
-def update_db(region,thedate,fcst,haus_navy,modhaus_navy,quanthaus_navy):
+def update_db(region,result):
         
-    init_db(dbfile,region['db'])    
-
-    # connect to db file
-    conn = sqlite3.connect(dbfile,detect_types=sqlite3.PARSE_DECLTYPES,timeout=30.0)
-    c = conn.cursor()    
+    row=stats_db.make_row(result['vdate'],result['fcst'],result['metrics'])
 
-    # Larger example that inserts many records at a time
-    update = (thedate,fcst,haus_navy,modhaus_navy,quanthaus_navy)
-    
-    c.execute('REPLACE INTO '+region['db']+' VALUES (?,?,?,?,?)', update)
-    
-    # Save (commit) the changes
-    conn.commit()
-                 
-    # close the connection
-    conn.close()    
+    if stats_queue is not None:
+        stats_queue.put((region['db'],row))
+    else:
+        conn=stats_db.connect(dbFile)
+        stats_db.write_rows(conn,[(region['db'],row)])
+        conn.close()
     
 #-------------------------------------
 # load all of the regions of interest 
@@ -130,6 +136,7 @@ def load_regions():
     region['gulfstream']['db']='gulfstream'
     region['gulfstream']['lims']=[-85, -40, 20, 50]  # (minlon,maxlon,minlat,maxlat)
     region['gulfstream']['loc']=[12,400,12]          # T,depth,znum
+    region['gulfstream']['geodesic']=True            # also compute metrics in km
     
     region['loopcurrent']={}
     region['loopcurrent']['name']='Loop Current'
@@ -137,6 +144,7 @@ def load_regions():
     region['loopcurrent']['db']='loopcurrent'
     region['loopcurrent']['lims']=[-100, -75, 15, 35]
     region['loopcurrent']['loc']=[12,400,12]
+    region['loopcurrent']['geodesic']=True
 
     region['kuroshio']={}
     region['kuroshio']['name']='N. Wall Kuroshio'
@@ -144,83 +152,326 @@ def load_regions():
     region['kuroshio']['db']='kuroshio'
     region['kuroshio']['lims']=[115, 162, 25, 45]
     region['kuroshio']['loc']=[16,200,9]
+    region['kuroshio']['geodesic']=True
     
     return region
 
+#-----------------------------------------------
+# find the i/j window of a region on the grid
+#-----------------------------------------------
+def region_window(lon,lat,lims):
+    """
+    Returns (yslice,xslice,box) for the region lims on the 2-D lon/lat grid,
+    where the slices bound every grid point in the lon/lat box and box is
+    the in-box mask over that window.
+    """
+    [minlon,maxlon,minlat,maxlat]=lims
+    inbox=(lon>=minlon%360) & (lon<=maxlon%360) & (lat>=minlat) & (lat<=maxlat)
+    rows=np.flatnonzero(inbox.any(axis=1))
+    cols=np.flatnonzero(inbox.any(axis=0))
+    yslice=slice(rows[0],rows[-1]+1)
+    xslice=slice(cols[0],cols[-1]+1)
+    return yslice,xslice,inbox[yslice,xslice]
+
+#-----------------------------------------------
+# persisted regional grid index
+#-----------------------------------------------
+def grid_checksum(nc):
+    """
+    Checksum of the model grid from a strided sample of Longitude/Latitude,
+    cheap enough to check on every read
+    """
+    stride={dim:slice(None,None,64) for dim in nc.Longitude.dims}
+    sha=hashlib.sha1(nc.Longitude.isel(stride).values.tobytes())
+    sha.update(nc.Latitude.isel(stride).values.tobytes())
+    return sha.hexdigest()
+
+def project_grid(lon,lat):
+    """
+    2-D lon/lat grid transformed to mapProj coordinates, returns (x,y)
+    """
+    xyz=mapProj.transform_points(crs.PlateCarree(),np.asarray(lon,dtype=np.float64),
+                                 np.asarray(lat,dtype=np.float64))
+    return xyz[...,0],xyz[...,1]
+
+def load_grid_index(nc,region):
+    """
+    Returns the region's grid window {'yslice','xslice','box','lon','lat','x','y'}
+    from gridFile, where box is the in-box mask, lon/lat are the 2-D
+    coordinates clipped to the window and x/y are the same points in mapProj
+    coordinates (for plot_map).  The entry is rebuilt from nc when the grid
+    shape, grid checksum, region limits or map projection no longer match.
+    """
+    reg=region['db']
+    shape=np.array(nc.Longitude.shape)
+    checksum=grid_checksum(nc)
+    
+    if not grid_index and os.path.exists(gridFile):
+        with np.load(gridFile) as npz:
+            grid_index.update({key:npz[key] for key in npz.files})
+            
+    # a new grid invalidates every region
+    if str(grid_index.get('checksum','')) != checksum or \
+        not np.array_equal(grid_index.get('shape',[]),shape):
+        grid_index.clear()
+        grid_index['checksum']=np.array(checksum)
+        grid_index['shape']=shape
+    
+    if not np.array_equal(grid_index.get(reg+'_lims',[]),region['lims']) or \
+        str(grid_index.get(reg+'_proj','')) != mapProj.proj4_init:
+        lon,lat=nc.Longitude.values,nc.Latitude.values
+        yslice,xslice,box=region_window(lon,lat,region['lims'])
+        grid_index[reg+'_lims']=np.array(region['lims'])
+        grid_index[reg+'_window']=np.array([yslice.start,yslice.stop,xslice.start,xslice.stop])
+        grid_index[reg+'_box']=box
+        grid_index[reg+'_lon']=lon[yslice,xslice]
+        grid_index[reg+'_lat']=lat[yslice,xslice]
+        grid_index[reg+'_proj']=np.array(mapProj.proj4_init)
+        grid_index[reg+'_x'],grid_index[reg+'_y']=project_grid(grid_index[reg+'_lon'],grid_index[reg+'_lat'])
+        try:
+            tmpfile=f'{gridFile}.{os.getpid()}.npz'
+            np.savez(tmpfile,**grid_index)
+            os.replace(tmpfile,gridFile)
+        except OSError as err:
+            print('Unable to save grid index',gridFile,err)
+
+    y0,y1,x0,x1=grid_index[reg+'_window']
+    return {'yslice':slice(int(y0),int(y1)),'xslice':slice(int(x0),int(x1)),
+            'box':grid_index[reg+'_box'],
+            'lon':grid_index[reg+'_lon'],'lat':grid_index[reg+'_lat'],
+            'x':grid_index[reg+'_x'],'y':grid_index[reg+'_y']}
+
+#-----------------------------------------------
+# compact model field storage
+#-----------------------------------------------
+def compact_field(data,mask):
+    """
+    float32 masked array that shares the given mask (not a copy of it)
+    """
+    return ma.array(np.asarray(data,dtype=np.float32),mask=mask,copy=False)
+
+#-----------------------------------------------
+# per-task memory budget and reporting
+#-----------------------------------------------
+def limit_memory(budget=None):
+    """
+    Pool initializer: cap each worker's address space (RLIMIT_AS) at budget
+    MB, so a task that outgrows it fails with MemoryError instead of pushing
+    the node into swap.  None leaves the limit alone.
+
+    This is virtual memory, not RSS: numpy, HDF5 and the thread arenas
+    reserve much more address space than they touch, so size the budget
+    from the peak address space each task prints, not from its peak RSS.
+    A task over the budget fails for good (MemoryError is not retried).
+    """
+    if budget is not None:
+        soft,hard=resource.getrlimit(resource.RLIMIT_AS)
+        resource.setrlimit(resource.RLIMIT_AS,(int(budget*2**20),hard))
+
+def peak_memory():
+    """
+    peak resident memory of this process in MB
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.
+
+def peak_address_space():
+    """
+    peak address space of this process in MB (VmPeak, what MEMORY_BUDGET
+    limits), NaN where /proc isn't available
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmPeak:'):
+                    return int(line.split()[1])/1024.
+    except OSError:
+        pass
+    return np.nan
+
 #-----------------------------------------------
 # read the global rtofs file                 	
 #-----------------------------------------------
 def read_model(fcst,validDate,region):
+    
+    model=read_models(fcst,validDate,{region['db']:region})
+    if model is not None:
+        model=model[region['db']]
+    return model
+
+#-----------------------------------------------
+# read the global rtofs files once for all regions
+#-----------------------------------------------
+def read_models(fcst,validDate,regions,navies=None,modeldir=None):
+    """
+    Opens each of the five RTOFS files for this forecast once and extracts 
+    every region's window from it.  Returns {reg:model} or None if the 
+    model data is missing.
+
+    If navies ({reg:navy}) has the region's Navy front, potential temperature
+    is only read and computed inside the front's clip window (see 
+    navy_clipmask) and masked elsewhere, which is all the metrics and plots
+    use.  Without it the whole regional field is computed.
+
+    The files are read from modeldir, by default the modelDir global or
+    else the run date's directory of archiveDir (validDate-fcst hours).  With CACHE_MODELS the
+    regions already in cacheDir are read from there, and only the others
+    from the RTOFS files (which are then cached in turn).
+    """
 
     theDate=validDate-timedelta(fcst/24)  # run date    
-    zdepth=region['loc'][2]
     
     if fcst == 0:
         fcst_str='n024'
     else:
         fcst_str='f{:03n}'.format(fcst)
 
-    if not os.path.exists(modelDir):
-        print('missing model data for',str(fcst),'hour fcst','('+validDate.strftime('%Y-%m-%d')+')')
-        print('looking for',modelDir)
-        model=None
-    else:
-        model={'lon':[],'lat':[]}
-
-        # open the datasets
-        nc_sal=xr.open_dataset(f'{modelDir}/rtofs_glo_3dz_{fcst_str}_daily_3zsio.nc',decode_times=True)
-        nc_tmp=xr.open_dataset(f'{modelDir}/rtofs_glo_3dz_{fcst_str}_daily_3ztio.nc',decode_times=True)
-        nc_ssh=xr.open_dataset(f'{modelDir}/rtofs_glo_2ds_{fcst_str}_diag.nc',decode_times=True)
-        nc_u=xr.open_dataset(f'{modelDir}/rtofs_glo_3dz_{fcst_str}_daily_3zuio.nc',decode_times=True)
-        nc_v=xr.open_dataset(f'{modelDir}/rtofs_glo_3dz_{fcst_str}_daily_3zvio.nc',decode_times=True)
-
-        # drop singleton dimensions
-        nc_sal=nc_sal.squeeze()
-        nc_tmp=nc_tmp.squeeze()
-        nc_ssh=nc_ssh.squeeze()
-        nc_u=nc_u.squeeze()
-        nc_v=nc_v.squeeze()
-
-        [minlon,maxlon,minlat,maxlat]=region['lims']
+    if modeldir is None:
+        modeldir=modelDir if modelDir else model_dir(theDate)
+        
+    # the Navy front of each region whose temp is clipped to it
+    fronts={}
+    if navies is not None:
+        fronts={reg:navies[reg][region['name'].upper()][validDate] for reg,region in regions.items() if reg in navies}
         
-        salin=nc_sal['salinity'][zdepth,].where( \
-            (nc_sal.Longitude>=minlon%360) & (nc_sal.Longitude<=maxlon%360) & \
-            (nc_sal.Latitude>=minlat) & (nc_sal.Latitude<=maxlat),drop=True)
-        temp=nc_tmp['temperature'][zdepth,].where( \
-            (nc_tmp.Longitude>=minlon%360) & (nc_tmp.Longitude<=maxlon%360) & \
-            (nc_tmp.Latitude>=minlat) & (nc_tmp.Latitude<=maxlat),drop=True)
-        sst=nc_tmp['temperature'][0,].where( \
-            (nc_tmp.Longitude>=minlon%360) & (nc_tmp.Longitude<=maxlon%360) & \
-            (nc_tmp.Latitude>=minlat) & (nc_tmp.Latitude<=maxlat),drop=True)
-        ssh=nc_ssh['ssh'].where( \
-            (nc_ssh.Longitude>=minlon%360) & (nc_ssh.Longitude<=maxlon%360) & \
-            (nc_ssh.Latitude>=minlat) & (nc_ssh.Latitude<=maxlat),drop=True)
-        u=nc_u['u'][0,].where( \
-            (nc_u.Longitude>=minlon%360) & (nc_u.Longitude<=maxlon%360) & \
-            (nc_u.Latitude>=minlat) & (nc_u.Latitude<=maxlat),drop=True)
-        v=nc_v['v'][0,].where( \
-            (nc_v.Longitude>=minlon%360) & (nc_v.Longitude<=maxlon%360) & \
-            (nc_v.Latitude>=minlat) & (nc_v.Latitude<=maxlat),drop=True)
+    models={}
+    if CACHE_MODELS:
+        for reg,region in regions.items():
+            model=model_cache.read(cacheDir,reg,theDate,fcst,cache_tag(region,fronts.get(reg)))
+            if model is not None:
+                models[reg]=model
+        regions={reg:region for reg,region in regions.items() if reg not in models}
+        if not regions:
+            return models
         
-        MT=pd.to_datetime(nc_tmp['MT'].values)
+    if not os.path.exists(modeldir):
+        print('missing model data for',str(fcst),'hour fcst','('+validDate.strftime('%Y-%m-%d')+')')
+        print('looking for',modeldir)
+        return None
+
+    # open the datasets
+    nc_sal=xr.open_dataset(f'{modeldir}/rtofs_glo_3dz_{fcst_str}_daily_3zsio.nc',decode_times=True)
+    nc_tmp=xr.open_dataset(f'{modeldir}/rtofs_glo_3dz_{fcst_str}_daily_3ztio.nc',decode_times=True)
+    nc_ssh=xr.open_dataset(f'{modeldir}/rtofs_glo_2ds_{fcst_str}_diag.nc',decode_times=True)
+    nc_u=xr.open_dataset(f'{modeldir}/rtofs_glo_3dz_{fcst_str}_daily_3zuio.nc',decode_times=True)
+    nc_v=xr.open_dataset(f'{modeldir}/rtofs_glo_3dz_{fcst_str}_daily_3zvio.nc',decode_times=True)
+
+    # drop singleton dimensions
+    nc_sal=nc_sal.squeeze()
+    nc_tmp=nc_tmp.squeeze()
+    nc_ssh=nc_ssh.squeeze()
+    nc_u=nc_u.squeeze()
+    nc_v=nc_v.squeeze()
 
-        model['lat']=temp['Latitude'].values
-        model['lon']=temp['Longitude'].values
+    ydim,xdim=nc_tmp.Longitude.dims
+    
+    for reg,region in regions.items():
+        try:
+            zdepth=region['loc'][2]
+        
+            # regional i/j window from the grid index, shared by all variables
+            grid=load_grid_index(nc_tmp,region)
+            yslice,xslice=grid['yslice'],grid['xslice']
+            box=xr.DataArray(grid['box'],dims=(ydim,xdim))
+
+            def subset(var,level=None,yslice=yslice,xslice=xslice,box=box):
+                # read only the hyperslab of the window (and levels), then blank points outside the box
+                if level is not None:
+                    var=var.isel({var.dims[0]:level})
+                return var.isel({ydim:yslice,xdim:xslice}).where(box)
+        
+            model={}
+            model['lat']=grid['lat']
+            model['lon']=grid['lon']
+            model['x']=grid['x']  # mapProj coordinates for the maps
+            model['y']=grid['y']
                 
-        model['temp']=seawater.temp(salin.to_masked_array(),temp.to_masked_array(),seawater.pres(region['loc'][1],model['lat']),2000)
-        model['sst']=sst.to_masked_array()
-        model['ssh']=ssh.to_masked_array()
-        model['u']=u.to_masked_array()
-        model['v']=v.to_masked_array()
-        model['current']=(u.to_masked_array()**2+v.to_masked_array()**2)**0.5
-        model['vdate']=validDate
-        model['rundate']=theDate
-        model['fcst']=fcst
+            # clip window of the Navy front inside the regional window
+            clipmask=navy_clipmask(model['lon'],model['lat'],fronts[reg]) if reg in fronts else None
+            if clipmask is None:
+                clipmask=np.zeros(model['lon'].shape,dtype=bool)
+            inclip=~clipmask & grid['box']
+            rows,cols=np.flatnonzero(inclip.any(axis=1)),np.flatnonzero(inclip.any(axis=0))
         
-    return model
+            # potential temperature at the isotherm depth, only inside the clip window
+            temp=np.full(model['lon'].shape,np.nan,dtype=np.float32)
+            if len(rows)>0:
+                ys,xs=slice(rows[0],rows[-1]+1),slice(cols[0],cols[-1]+1)
+                clipbox=xr.DataArray(inclip[ys,xs],dims=(ydim,xdim))
+                clipwin=(slice(yslice.start+ys.start,yslice.start+ys.stop),
+                         slice(xslice.start+xs.start,xslice.start+xs.stop))
+                salin=subset(nc_sal['salinity'],zdepth,*clipwin,clipbox).values
+                tclip=subset(nc_tmp['temperature'],zdepth,*clipwin,clipbox).values
+                temp[ys,xs]=seawater.temp(salin,tclip,seawater.pres(region['loc'][1],model['lat'][ys,xs]),2000)
+                del salin,tclip
+            model['temp']=compact_field(temp,np.isnan(temp) | clipmask)
+            del temp
+        
+            # surface fields are float32 and share one mask
+            sst=subset(nc_tmp['temperature'],0).values.astype(np.float32)
+            ssh=subset(nc_ssh['ssh']).values.astype(np.float32)
+            u=subset(nc_u['u'],0).values.astype(np.float32)
+            v=subset(nc_v['v'],0).values.astype(np.float32)
+            mask=np.isnan(sst) | np.isnan(ssh) | np.isnan(u) | np.isnan(v)
+            model['sst']=compact_field(sst,mask)
+            model['ssh']=compact_field(ssh,mask)
+            model['u']=compact_field(u,mask)
+            model['v']=compact_field(v,mask)
+            model['current']=compact_field(np.hypot(u,v),mask)
+            model['vdate']=validDate
+            model['rundate']=theDate
+            model['fcst']=fcst
+            models[reg]=model
+            if CACHE_MODELS:
+                model_cache.write(cacheDir,reg,model,cache_tag(region,fronts.get(reg)),CACHE_MB)
+        except OSError:
+            raise  # I/O errors fail (and retry) the whole job
+        except Exception:
+            region_failed(reg,fcst,validDate)
+
+    for nc in [nc_sal,nc_tmp,nc_ssh,nc_u,nc_v]:
+        nc.close()
+        
+    return models
+#--------------------------------------------------------------------------
+# model cache entries are only used with the same region settings, map
+# projection and temp clipping.  The cached temp is only computed inside the
+# clip window of the Navy front it was read for (see navy_clipmask), so the
+# window is part of the tag, or 'full' if it was read without a front.
+#--------------------------------------------------------------------------
+def cache_tag(region,navy=None):
+    if navy is None or len(navy['lat'])==0:
+        clip='full'
+    else:
+        clip=' '.join([f'{value:.4f}' for value in [min(navy['lat']),max(navy['lat']),
+                                                     min(navy['lon'])%360,max(navy['lon'])%360]])
+    return f"{list(region['lims'])} {list(region['loc'])} {mapProj.proj4_init} {clip}"
+
+#--------------------------------------------------------------------------
+# mask of model points outside the Navy front's lat/lon range +/-1 degree,
+# or None for an empty front (a NAVO bulletin without one of its walls)
+#--------------------------------------------------------------------------
+def navy_clipmask(lon,lat,navy):
+    if len(navy['lat'])==0:
+        return None
+    # NAVOCEANO fronts start with a NaN break, which makes the builtin
+    # min/max return NaN and leaves those fronts unclipped, as they always were
+    return ((lat<min(navy['lat'])-1) |
+            (lat>max(navy['lat'])+1) |
+            (lon<min(navy['lon'])%360-1) |
+            (lon>max(navy['lon'])%360+1))
+
 #--------------------------------------------------------------------------
 # calculate the Hausdorff metrics           	                           
 #   this computes three hausdorff metrics, original, modified and quantile 
+#   in degrees, and again in km for regions with region['geodesic'] set.
+#   Returns the result dict used by the plots and the database:
+#     vdate, fcst   valid date and forecast hour
+#     isotherm      model['temp'] clipped to the navy frontal region
+#     model_front   (N,2) lon/lat of the model front
+#     navy_front    (N,2) lon/lat of the navy front
+#                   (both before any resampling, as kept in the front store)
+#     metrics       {column:value} for update_db
+#   The model fields are not modified.
 #--------------------------------------------------------------------------
 def hausdorff_metrics(model,navy,region):
     
@@ -229,56 +480,124 @@ def hausdorff_metrics(model,navy,region):
     lims=region['lims']
         
     #clip to the navy frontal region
-    clipmask = ((model['lat']<min(navy['lat'])-1) |
-                (model['lat']>max(navy['lat'])+1) |
-                (model['lon']<min(navy['lon'])%360-1) |
-                (model['lon']>max(navy['lon'])%360+1))
+    clipmask=navy_clipmask(model['lon'],model['lat'],navy)
+    if clipmask is None:
+        raise ValueError(f"empty Navy front for {region['name']} on {model['vdate']:%Y%m%d}")
 
     # Pull out the temperature contour at the specified depth and clip to the navy frontal region
-    model['temp'].mask=ma.mask_or(model['temp'].mask,clipmask)    
-    CS=plt.contour(model['lon'],model['lat'],model['temp'],[region['loc'][2]])
-    
-    # sort and select the longest contour segment.  This removes closed eddies.
-    [segs]=CS.allsegs
-    seglen=np.array([s.shape[0] for s in segs])
-    i=np.argsort(seglen).tolist()
-    i.reverse()
-    model_front=segs[i[0]]  # the longest segment is (hopefully) the main front
-
-    haus_navy=[]
-    modhaus_navy=[]
-    quanthaus_navy=[]
+    isotherm=ma.array(model['temp'],mask=ma.mask_or(model['temp'].mask,clipmask),copy=False)
+    
+    # select the longest contour segment (headless, no pyplot state).  This removes closed eddies.
+    model_front=extract_front(model['lon'],model['lat'],isotherm,region['loc'][2])
+
     navy_front=np.stack((navy['lon']%360,navy['lat'])).T
-    haus_navy=haus.hausdorff(model_front,navy_front)
-    modhaus_navy=haus.mod_hausdorff(model_front,navy_front)
-    quanthaus_navy=haus.quantile_hausdorff(model_front,navy_front,QUANTILE)
-
-    if haus_navy==[]:
-        haus_navy=np.nan
-    if modhaus_navy==[]:
-        modhaus_navy=np.nan
-    if quanthaus_navy==[]:
-        quanthaus_navy=np.nan
+    model_line,navy_line=model_front,navy_front
+    if RESAMPLE_KM is not None or RESAMPLE_POINTS is not None:
+        model_line=haus.resample_front(model_front,RESAMPLE_KM,RESAMPLE_POINTS,geodesic=True)
+        navy_line=haus.resample_front(navy_front,RESAMPLE_KM,RESAMPLE_POINTS,geodesic=True)
+    degrees=haus.front_metrics(model_line,navy_line,QUANTILE)
+    metrics={'haus_navy':degrees['haus'],
+             'modhaus_navy':degrees['modhaus'],
+             'quanthaus_navy':degrees['quanthaus']}
+    if region.get('geodesic',False):
+        km=haus.front_metrics(model_line,navy_line,QUANTILE,geodesic=True)
+        metrics.update({'haus_km':km['haus'],
+                        'modhaus_km':km['modhaus'],
+                        'quanthaus_km':km['quanthaus']})
             
-    return haus_navy, modhaus_navy, quanthaus_navy
+    return {'vdate':model['vdate'],'fcst':model['fcst'],'isotherm':isotherm,
+            'model_front':model_front,'navy_front':navy_front,'metrics':metrics}
+
+#-----------------------------------------------
+# add the NOAA and NWS logos to the top corners
+#   (the images are read once per process)
+#-----------------------------------------------
+def add_mmab_logos(fig):
+    
+    if not logos:
+        logos['noaa']=image.imread(logoDir+'/NOAA_logo.png')
+        logos['nws']=image.imread(logoDir+'/NWS_logo.png')
+    fig.figimage(logos['noaa'],
+      yo=fig.get_figheight()*fig.dpi-logos['noaa'].shape[0])
+    fig.figimage(logos['nws'],
+      xo=fig.get_figwidth()*fig.dpi-logos['nws'].shape[1],
+      yo=fig.get_figheight()*fig.dpi-logos['nws'].shape[0])
+
+#-----------------------------------------------
+# per-region base map for plot_map
+#   projection, extent, coastlines, gridlines, colorbar axes, logos and
+#   annotations are built once per region and process, and kept in base_maps
+#-----------------------------------------------
+def base_map(region):
+    
+    if region['db'] in base_maps:
+        return base_maps[region['db']]
+    
+    fig=plt.figure(dpi=150)
+    ax=plt.axes(projection=mapProj)
+    ax.set_extent(np.array(region['lims'])%360,crs=crs.PlateCarree())
+    
+    # take the colorbar space now, the same way plt.colorbar would
+    if getattr(ax,'get_subplotspec',lambda:None)() is not None:
+        cax,cbar_kw=colorbar.make_axes_gridspec(ax)
+    else:
+        cax,cbar_kw=colorbar.make_axes(ax)
+    
+    ax.coastlines()
+    gl=ax.gridlines(draw_labels=True)
+    gl.xlabels_top=False
+    gl.ylabels_right=False
+    
+    # metrics box, filled in by plot_map
+    txt=ax.text(0.50,0.95,'',
+        fontsize='x-small',horizontalalignment='center',verticalalignment='top',
+        multialignment='left',transform=ax.transAxes,color='black',
+        bbox=dict(facecolor='white'))
+    txt.set_multialignment('right')
+    txt.set_family('monospace')
+
+    # add some branding and dates
+    add_mmab_logos(fig)
+    ax.annotate('NCEP/EMC Verification Post Processing Product Generation Branch',
+      xy=(0.01,0.01),xycoords='figure fraction',
+      horizontalalignment='left',fontsize='x-small')
+    ax.annotate(f'{datetime.now():%d %b %Y} $on Hera$',
+      xy=(0.99,0.01),xycoords='figure fraction',
+      horizontalalignment='right',fontsize='x-small')    
+    
+    base_maps[region['db']]={'fig':fig,'ax':ax,'cax':cax,'cbar_kw':cbar_kw,'text':txt}
+    return base_maps[region['db']]
+
+#-----------------------------------------------
+# take a data layer back off a base map
+#   (contour sets are a single artist from matplotlib 3.8, collections before)
+#-----------------------------------------------
+def remove_layer(layer):
+    
+    if isinstance(layer,matplotlib.artist.Artist):
+        layer.remove()
+    else:
+        for collection in layer.collections:
+            collection.remove()
+
 #-----------------------------------------------
 # create the maps                           	
 #-----------------------------------------------
-def plot_map(model,param,navy,region):
+def plot_map(model,param,navy,region,result):
 
     #navy=navy[region['name'].upper()][model['vdate']]
-    reg=region['db']    
-    lims=region['lims']
     source=region['source']
 
-    # generate contour for hausdorff and plotting
-    haus_navy,modhaus_navy,quanthaus_navy=hausdorff_metrics(model,navy,region)
+    # metrics and clipped isotherm from hausdorff_metrics
+    metrics=result['metrics']
+    modhaus_navy,quanthaus_navy=metrics['modhaus_navy'],metrics['quanthaus_navy']
     
     data=model[param]
-        
-    fig=plt.figure(dpi=150)
-    ax=plt.axes(projection=crs.Mercator())
-    ax.set_extent(np.array(lims)%360,crs=crs.PlateCarree())
+    
+    # static layers come from the region's base map, only the data layers are drawn here
+    base=base_map(region)
+    fig,ax,cax=base['fig'],base['ax'],base['cax']
+    layers=[]
     
     if param=='ssh':
         pcm='bwr'
@@ -296,32 +615,38 @@ def plot_map(model,param,navy,region):
         ncm='black'
         ocm='white'
         
+    # gridded layers are drawn on the grid index's projected coordinates, so
+    # cartopy doesn't reproject every polygon and arrow
+    x,y=model['x'],model['y']
+        
     #m.pcolormesh(x,y,data,cmap=plt.cm.gist_rainbow_r)
     if param=='ssh':
-        plt.contourf(model['lon'],model['lat'],data,30,cmap=pcm,
+        CF=ax.contourf(x,y,data,30,cmap=pcm,
             norm=MidpointNormalize(midpoint=0.,
             vmin=data.min(),
             vmax=data.max()),alpha=0.4,
-            transform=crs.PlateCarree())
+            transform=mapProj)
     else:
-        plt.contourf(model['lon'],model['lat'],data,30,cmap=pcm,alpha=0.4,
-            transform=crs.PlateCarree())
-    cbar=plt.colorbar()
+        CF=ax.contourf(x,y,data,30,cmap=pcm,alpha=0.4,
+            transform=mapProj)
+    layers.append(CF)
+    cbar=fig.colorbar(CF,cax=cax,**base['cbar_kw'])
     cbar.ax.tick_params(labelsize='x-small')
     if param=='current':
         rskip=int(np.floor(model['lon'].shape[0]/60))
         cskip=int(np.floor(model['lon'].shape[1]/60))
-        plt.quiver(model['lon'][::rskip,::cskip],model['lat'][::rskip,::cskip],
+        # Mercator is conformal, so u/v need no rotation into map coordinates
+        layers.append(ax.quiver(x[::rskip,::cskip],y[::rskip,::cskip],
                  model['u'][::rskip,::cskip],model['v'][::rskip,::cskip],
                  units='inches',scale_units='inches',width=0.01,scale=6,
-                 color='white',transform=crs.PlateCarree())
+                 color='white',transform=mapProj))
     
     #x2,y2=m(navy[region['name'].upper()][model['vdate']]['lon']%360,
     #      navy[region['name'].upper()][model['vdate']]['lat'])
     x2=navy[region['name'].upper()][model['vdate']]['lon']%360
     y2=navy[region['name'].upper()][model['vdate']]['lat']
     if source=='NAVOCEANO':
-        plt.plot(x2,y2,'-',color=ncm,label=source,linewidth=2,
+        layers+=ax.plot(x2,y2,'-',color=ncm,label=source,linewidth=2,
         zorder=1,transform=crs.PlateCarree())
     else:
         for key in list(navy.keys()):
@@ -329,60 +654,62 @@ def plot_map(model,param,navy,region):
             x2=navy[key][model['vdate']]['lon']%360
             y2=navy[key][model['vdate']]['lat']
             if key.find('NORTH')>=0:
-                plt.plot(x2,y2,'-',color=ncm,label='NAVO',linewidth=2,zorder=1,
+                layers+=ax.plot(x2,y2,'-',color=ncm,label='NAVO',linewidth=2,zorder=1,
                     transform=crs.PlateCarree())
             else:
-                plt.plot(x2,y2,'-',color=ncm,linewidth=2,zorder=1,
+                layers+=ax.plot(x2,y2,'-',color=ncm,linewidth=2,zorder=1,
                     transform=crs.PlateCarree())
                 
-    CS=plt.contour(model['lon'],model['lat'],model['temp'],[region['loc'][2]],
+    layers.append(ax.contour(x,y,result['isotherm'],[region['loc'][2]],
                  colors=rcm,linestyles='-',linewidths=2,zorder=10,
-                 transform=crs.PlateCarree())
-    CS.collections[0].set_label('RTOFS')
+                 transform=mapProj))
+    # legend entry for the isotherm (contour sets are not labelled the same way in every matplotlib)
+    layers+=ax.plot([],[],'-',color=rcm,linewidth=2,label='RTOFS')
         
-    plt.legend(loc='upper left',fontsize='xx-small',facecolor='lightgrey')
-    ax.coastlines()
-    gl=ax.gridlines(draw_labels=True)
-    gl.xlabels_top=False
-    gl.ylabels_right=False
+    layers.append(ax.legend(loc='upper left',fontsize='xx-small',facecolor='lightgrey'))
         
-    plt.title('Global RTOFS '+region['name']+' Location\n'+ \
+    ax.set_title('Global RTOFS '+region['name']+' Location\n'+ \
         "{:03n}".format(model['fcst'])+'H fcst valid '+model['vdate'].strftime('%B %d, %Y')+ \
         ' model run date '+model['rundate'].strftime('%B %d, %Y')+'\n'+ \
         str(region['loc'][0])+'$^\circ$C Isotherm and '+ \
         str(region['loc'][1])+' m with '+ \
         param.upper(),fontsize='small') 
             
-    txt=plt.text(0.50,0.95, \
+    base['text'].set_text( \
     	# "{:>16}{:5.2f}".format('Hausdorff = ',haus_navy)+' '+source+'\n'+ \
         f'     Modified Hausdorff: {modhaus_navy:5.2f} {source}\n'+\
-        f'{int(QUANTILE*100)}th Quantile Hausdorff: {quanthaus_navy:5.2f} {source}\n',
-        fontsize='x-small',horizontalalignment='center',verticalalignment='top',
-        multialignment='left',transform=ax.transAxes,color='black',
-        bbox=dict(facecolor='white'))
-    txt.set_multialignment('right')
-    txt.set_family('monospace')
-
-    # add some branding and dates
-    noaa_logo=image.imread('/scratch2/NCEPDEV/marine/Todd.Spindler/save/Logos/NOAA_logo.png')
-    nws_logo=image.imread('/scratch2/NCEPDEV/marine/Todd.Spindler/save/Logos/NWS_logo.png')
-    fig.figimage(noaa_logo,
-      yo=fig.get_figheight()*fig.dpi-noaa_logo.shape[0])
-    fig.figimage(nws_logo,
-      xo=fig.get_figwidth()*fig.get_dpi()-nws_logo.shape[1],
-      yo=fig.get_figheight()*fig.get_dpi()-nws_logo.shape[0])
-    plt.annotate('NCEP/EMC Verification Post Processing Product Generation Branch',
-      xy=(0.01,0.01),xycoords='figure fraction',
-      horizontalalignment='left',fontsize='x-small')
-    plt.annotate(f'{datetime.now():%d %b %Y} $on Hera$',
-      xy=(0.99,0.01),xycoords='figure fraction',
-      horizontalalignment='right',fontsize='x-small')    
+        f'{int(QUANTILE*100)}th Quantile Hausdorff: {quanthaus_navy:5.2f} {source}\n')
     
-    plt.savefig(imageDir+'/'+model['vdate'].strftime('%Y%m%d')+'/'+region['db']+'_location_'+param+'_'+"{:03n}".format(model['fcst'])+'.png',dpi=fig.dpi)
-    plt.close()
+    fig.savefig(map_file(model['vdate'],model['fcst'],region,param),dpi=fig.dpi)
+    
+    # back to the bare base map for the next parameter or forecast
+    for layer in layers:
+        remove_layer(layer)
+    cax.clear()
     
     return
 
+#-----------------------------------------------
+# write the blockDates.js file of missing nowcast dates (once per run)
+#-----------------------------------------------
+def write_block_dates(regions):
+
+    conn = stats_db.connect(dbFile)
+    tables=[region['db'] for region in regions.values()]
+    stats_db.ensure_indexes(conn,tables)
+    dates=stats_db.nowcast_dates(conn,tables)  # only nowcast for this
+    missing_dates=stats_db.missing_dates(conn,tables).strftime('%Y-%m-%d')
+    conn.close()
+    if len(dates)==0:
+        return
+    
+    # print out blockDates.js file
+    with open(imageDir+'/blockDates.js','w') as f:
+        f.write('var minDate=new Date("{}");\n'.format(dates[0].strftime('%Y/%m/%d')))
+        f.write('var maxDate=new Date("{}");\n'.format(dates[-1].strftime('%Y/%m/%d')))
+        f.write('var blockDates=new Object();\n')
+        f.write('blockDates={};\n'.format(list(missing_dates)))
+
 #-----------------------------------------------
 # extract stats from sqlite db and plot       	
 #-----------------------------------------------
@@ -392,37 +719,11 @@ def plot_stats(region):
     loc = WeekdayLocator(byweekday=MO)
     dateFmt=DateFormatter("%b %Y")
 
-    # get all dates
-    dbfile='/scratch2/NCEPDEV/marine/Todd.Spindler/save/VPPPG/Global_RTOFS/EMC_ocean-verification/fronts/fix/global_fronts.db'
-    conn = sqlite3.connect(dbfile,detect_types=sqlite3.PARSE_DECLTYPES,timeout=30.0)
-    df=pd.read_sql_query('SELECT date, forecast FROM gulfstream '+\
-                         'UNION '+\
-                         'SELECT date, forecast FROM loopcurrent '+\
-                         'UNION '+\
-                         'SELECT date, forecast FROM kuroshio '+\
-                         'ORDER BY date', conn)
+    # last 12 weeks only, filtered in the database
+    conn = stats_db.connect(dbFile)
+    df=stats_db.read_stats(conn,region['db'],start=pd.Timestamp.now()-pd.Timedelta(weeks=12))
     conn.close()
-    
-    # extract missing dates and print out blockDates.js file
-    df=df[df.forecast==0]  # only nowcast for this
-    df['date'] = pd.to_datetime(df.date)
-    df.set_index('date',inplace=True)
-    df=df.resample('1D').mean()  # get rid of dupes (what are they doing here?)
-    missing_dates=df[np.isnan(df.forecast)].index.strftime('%Y-%m-%d')
-    df=df.dropna()
-    with open(imageDir+'/blockDates.js','w') as f:
-        f.write('var minDate=new Date("{}");\n'.format(df.index.strftime('%Y/%m/%d')[0]))
-        f.write('var maxDate=new Date("{}");\n'.format(df.index.strftime('%Y/%m/%d')[-1]))
-        f.write('var blockDates=new Object();\n')
-        f.write('blockDates={};\n'.format(missing_dates.format()))
 
-    conn = sqlite3.connect(dbfile,detect_types=sqlite3.PARSE_DECLTYPES,timeout=30.0)
-    df=pd.read_sql_query(
-    	'SELECT DISTINCT date, forecast, modhaus_navy, quanthaus_navy FROM '
-        +region['db']+' ORDER BY date AND forecast',conn)                
-    conn.close()
-
-    df=df[df.date>=pd.Timestamp.now()-pd.Timedelta(weeks=12)]
     df.set_index('date',inplace=True)
     
     for fcst in df.forecast.unique():
@@ -441,14 +742,7 @@ def plot_stats(region):
         plt.title(f'{int(QUANTILE*100)}th Quantile Hausdorff for {region["name"]} {fcst:03n}Z forecast',fontsize='small')
         
         # add some branding and dates
-        #add_mmab_logos()
-        noaa_logo=image.imread('/scratch2/NCEPDEV/marine/Todd.Spindler/save/Logos/NOAA_logo.png')
-        nws_logo=image.imread('/scratch2/NCEPDEV/marine/Todd.Spindler/save/Logos/NWS_logo.png')
-        fig.figimage(noaa_logo,
-            yo=fig.get_figheight()*fig.dpi-noaa_logo.shape[0])
-        fig.figimage(nws_logo,
-            xo=fig.get_figwidth()*fig.dpi-nws_logo.shape[1],
-            yo=fig.get_figheight()*fig.dpi-nws_logo.shape[0])
+        add_mmab_logos(fig)
         plt.annotate('NCEP/EMC/Verification Post Processing Product Generation Branch',
             xy=(0.01,0.01),xycoords='figure fraction',
             horizontalalignment='left',fontsize='x-small')
@@ -461,95 +755,489 @@ def plot_stats(region):
         plt.savefig(imageDir+'/stats/'+region['db']+'_hausdorff_'+"{:03n}".format(fcst)+'.png',dpi=fig.dpi)
         plt.close()
         
+#-----------------------------------------------
+# plot the lead-time skill curve from the weekly summaries
+#-----------------------------------------------
+def plot_skill(region,weeks=12):
+
+    conn = stats_db.connect(dbFile)
+    curve=stats_db.skill_curve(conn,region['db'],'quanthaus_navy',
+                               start=pd.Timestamp.now()-pd.Timedelta(weeks=weeks))
+    conn.close()
+    if len(curve)==0:
+        return
+    
+    fig=plt.figure(dpi=150)
+    ax=plt.axes()
+    plt.plot(curve.index,curve['mean'],'o-',color='red',linewidth=2)
+    plt.grid(axis='both',which='both')
+    ax.set_xticks(curve.index)
+    ax.tick_params(labelsize='x-small')
+    plt.xlabel('forecast hour',fontsize='x-small')
+    plt.title(f'{int(QUANTILE*100)}th Quantile Hausdorff for {region["name"]} by forecast hour\n'+
+              f'mean of the last {weeks} weeks',fontsize='small')
+    add_mmab_logos(fig)
+    plt.annotate('NCEP/EMC/Verification Post Processing Product Generation Branch',
+        xy=(0.01,0.01),xycoords='figure fraction',
+        horizontalalignment='left',fontsize='x-small')
+    plt.annotate(datetime.now().strftime('%d %b %Y'),
+        xy=(0.99,0.01),xycoords='figure fraction',
+        horizontalalignment='right',fontsize='x-small')
+        
+    if not os.path.isdir(imageDir+'/stats'):
+        os.makedirs(imageDir+'/stats')
+    plt.savefig(imageDir+'/stats/'+region['db']+'_hausdorff_skill.png',dpi=fig.dpi)
+    plt.close()
+        
 #--------------
 # do the thing 
 #--------------
-def process_region(region,fcst,navy,theDate):
+def process_region(region,fcst,navy,theDate,model=None):
     
     # load RTOFS
-    model=read_model(fcst,theDate,region)
+    if model is None:
+        model=read_model(fcst,theDate,region)
+    
+    # compute the metrics once, for the dbase and all of the maps
+    result=compute_region(region,navy,model)
+    
+    # make pretty pictures
+    if WANT_MAPS:
+        render_region(model,navy,region,result)
+    return
+
+#-----------------------------------------------
+# metrics, dbase update and front store part for one region
+#-----------------------------------------------
+def compute_region(region,navy,model):
     
-    # compute the metrics
-    haus_navy,modhaus_navy,quanthaus_navy=hausdorff_metrics(model,navy,region)
+    result=hausdorff_metrics(model,navy,region)
     
     # update the dbase
     if UPDATE_DB:
-        update_db(region,model['vdate'],fcst,haus_navy,modhaus_navy,quanthaus_navy)
+        update_db(region,result)
         
+    # keep both fronts, so the metrics can be redone from the store
+    if WANT_FRONTS:
+        vdate,fcst=result['vdate'],result['fcst']
+        front_store.write_part(frontDir,f'{vdate:%Y%m%d}_{fcst:03n}_{region["db"]}',
+                               [(vdate,region['db'],fcst,'model',result['model_front']),
+                                (vdate,region['db'],front_store.NAVY_FORECAST,'navy',result['navy_front'])])
+    return result
+
+#-----------------------------------------------
+# the three maps of one region and forecast
+#-----------------------------------------------
+def render_region(model,navy,region,result):
+    
     # create imagedir by date if needed
     if not os.path.isdir(imageDir+'/'+model['vdate'].strftime('%Y%m%d')):
-        os.makedirs(imageDir+'/'+model['vdate'].strftime('%Y%m%d'))
+        os.makedirs(imageDir+'/'+model['vdate'].strftime('%Y%m%d'),exist_ok=True)
     if not os.path.isdir(imageDir+'/stats'):
-        os.makedirs(imageDir+'/stats')
+        os.makedirs(imageDir+'/stats',exist_ok=True)
         
-    # make pretty pictures
-    plot_map(model,'sst',navy,region)
-    plot_map(model,'ssh',navy,region)
-    plot_map(model,'current',navy,region),
+    for param in mapParams:
+        plot_map(model,param,navy,region,result)
     return
 
+def map_file(vdate,fcst,region,param):
+    return imageDir+'/'+vdate.strftime('%Y%m%d')+'/'+region['db']+'_location_'+param+'_'+"{:03n}".format(fcst)+'.png'
+
+def maps_drawn(vdate,fcst,region):
+    return all([os.path.exists(map_file(vdate,fcst,region,param)) for param in mapParams])
+
+#---------------------------------------------------
+# do the thing for all regions of one forecast hour
+#---------------------------------------------------
+def process_forecast(regions,fcst,navies,theDate):
+    
+    # load RTOFS once for all regions, isotherms only inside the Navy fronts
+    models=read_models(fcst,theDate,regions,navies)
+    if models is None:
+        return []
+    
+    done=[]
+    for (reg,region) in list(regions.items()):
+        if reg not in models:
+            continue
+        try:
+            process_region(region,fcst,navies[reg],theDate,models[reg])
+        except Exception:
+            region_failed(reg,fcst,theDate)
+            continue
+        done.append(reg)
+        
+    print(f'fcst {fcst} peak memory {peak_memory():.0f} MB, address space {peak_address_space():.0f} MB')
+    return done
+
+#---------------------------------------------------
+# report a region that failed, so the others of its forecast go on
+#---------------------------------------------------
+def region_failed(reg,fcst,theDate):
+    print(f'{reg} {theDate:%Y%m%d} fcst {fcst} failed -- skipping it')
+    traceback.print_exc()
+
+#---------------------------------------------------
+# model archive directory of a run date
+#   archiveDir/YYYYMMDD holds the files of the run started that day: its
+#   nowcast (n024, valid that day) and forecasts (fNNN, valid NNN hours later)
+#---------------------------------------------------
+def model_dir(theDate):
+    return archiveDir+'/'+theDate.strftime('%Y%m%d')
+
+#---------------------------------------------------
+# compute pool task: one forecast hour, all regions
+#   Reads the model, computes the metrics and updates the dbase, then hands
+#   the plotted fields to the render pool in shared memory.  The Navy fronts
+#   come from navy_fronts, inherited from the parent instead of pickled.
+#   Returns {reg:descriptor} of the shared_fields blocks, with None for
+#   descriptors when WANT_MAPS is off, or {} if the model data is missing.
+#---------------------------------------------------
+def compute_forecast(regions,fcst,theDate):
+    
+    models=read_models(fcst,theDate,regions,navy_fronts)
+    if models is None:
+        return {}
+    
+    shared={}
+    try:
+        for (reg,region) in list(regions.items()):
+            if reg not in models:
+                continue
+            model=models.pop(reg)
+            try:
+                result=compute_region(region,navy_fronts[reg],model)
+            except Exception:
+                # only this region is missing from the result
+                region_failed(reg,fcst,theDate)
+                continue
+            shared[reg]=None
+            if WANT_MAPS:
+                arrays={key:model[key] for key in plotFields}
+                arrays['isotherm']=result['isotherm']
+                shared[reg]=shared_fields.share(arrays,{'region':region,
+                    'vdate':model['vdate'],'rundate':model['rundate'],'fcst':model['fcst'],
+                    'metrics':result['metrics']})
+                del arrays
+            del model,result
+    except BaseException:
+        # a failed attempt (retried or not) doesn't leave its blocks behind
+        discard_shared(shared)
+        raise
+        
+    print(f'fcst {fcst} peak memory {peak_memory():.0f} MB, address space {peak_address_space():.0f} MB')
+    return shared
+
+#---------------------------------------------------
+# unlink the blocks of a compute_forecast result that won't be rendered
+#---------------------------------------------------
+def discard_shared(shared):
+    for item in shared.values():
+        if item is not None:
+            shared_fields.discard(item)
+
+#---------------------------------------------------
+# render pool task: the maps of one region and forecast from shared memory
+#---------------------------------------------------
+def render_shared(shared):
+    
+    with shared_fields.attached(shared) as (arrays,meta):
+        region=meta['region']
+        model=dict(arrays,vdate=meta['vdate'],rundate=meta['rundate'],fcst=meta['fcst'])
+        result={'isotherm':model.pop('isotherm'),'metrics':meta['metrics']}
+        render_region(model,navy_fronts[region['db']],region,result)
+        del model,result
+    return
+
+#---------------------------------------------------
+# Navy fronts for a date range (may span years)
+#---------------------------------------------------
+def load_navy(start,end):
+    
+    navo,navoceano={},{}
+    for year in range(start.year,end.year+1):
+        for (fronts,decoded) in [(navo,read_navo(str(year),start=start,end=end)),
+                                 (navoceano,read_navoceano(str(year),start=start,end=end))]:
+            for name,dates in decoded.items():
+                fronts.setdefault(name,{}).update(dates)
+    return navo,navoceano
+
+#---------------------------------------------------
+# regions with a Navy front on theDate
+#   a NAVO bulletin without one of its walls leaves that wall's front empty
+#---------------------------------------------------
+def active_regions(regions,navies,theDate):
+
+    active={}
+    for (reg,region) in list(regions.items()):
+        navy=navies[reg].get(region['name'].upper(),{}).get(theDate)
+        if navy is None:
+            print(theDate.strftime('%Y%m%d'),'not found -- skipping',reg)
+        elif len(navy['lat'])==0:
+            print(theDate.strftime('%Y%m%d'),'empty front -- skipping',reg)
+        else:
+            active[reg]=region
+    return active
+
+#---------------------------------------------------
+# backfill checkpoint
+#   one 'YYYYMMDD fcst region' line per finished key, appended as they finish
+#---------------------------------------------------
+def checkpoint_key(theDate,fcst,reg):
+    return f'{theDate:%Y%m%d} {fcst} {reg}'
+
+def read_checkpoint(filename):
+    
+    if filename is None or not os.path.exists(filename):
+        return set()
+    with open(filename) as f:
+        return set([line.strip() for line in f if line.strip()])
+
+def mark_done(filename,theDate,fcst,reg):
+    
+    if filename is not None:
+        with open(filename,'a') as f:
+            f.write(checkpoint_key(theDate,fcst,reg)+'\n')
+
+#---------------------------------------------------
+# (date,forecast) keys already in the stats dbase, per region
+#---------------------------------------------------
+def existing_keys(regions,start,end):
+    
+    if not os.path.exists(dbFile):
+        return {reg:set() for reg in regions}
+    conn=stats_db.connect(dbFile)
+    tables=stats_db.existing_tables(conn,[region['db'] for region in regions.values()])
+    keys={reg:stats_db.existing_keys(conn,region['db'],start,end) if region['db'] in tables else set()
+          for (reg,region) in regions.items()}
+    conn.close()
+    return keys
+
+#---------------------------------------------------
+# sharded runs
+#   each shard writes to shardDir/<dbFile name>_START_END_shard{n}of{count}.db,
+#   and merge_shards folds the shards of one run into dbFile
+#---------------------------------------------------
+def shard_file(shard,shards,start,end):
+    return shardDir+'/'+os.path.basename(dbFile).replace('.db',f'_{start:%Y%m%d}_{end:%Y%m%d}_shard{shard}of{shards}.db')
+
+def merge_shards(shards,start,end):
+    """
+    merge the shard databases of the run of start to end in shards shards,
+    removing each once its rows are committed.  False if any are missing.
+    """
+    shardfiles=[shard_file(shard,shards,start,end) for shard in range(shards)]
+    missing=[shardfile for shardfile in shardfiles if not os.path.exists(shardfile)]
+    for shardfile in missing:
+        print('missing shard database',shardfile)
+    conn=stats_db.connect(dbFile)
+    for shardfile in shardfiles:
+        if shardfile in missing:
+            continue
+        nrows=stats_db.merge_db(conn,shardfile)
+        print('merged',nrows,'rows from',shardfile)
+        for suffix in ['','-wal','-shm']:
+            if os.path.exists(shardfile+suffix):
+                os.remove(shardfile+suffix)
+    conn.close()
+    return not missing
+
 #------------------------------------
 # start of main routine              
 #------------------------------------
 if __name__ == '__main__':
     
-    if len(sys.argv)==1:
+    parser=argparse.ArgumentParser(description='WBC fronts verification of Global RTOFS')
+    parser.add_argument('dates',nargs='*',help='YYYYMMDD (default yesterday), or START END to backfill a date range')
+    parser.add_argument('--force',action='store_true',help='backfill: redo keys already in the stats database, maps drawn or not')
+    parser.add_argument('--metrics-only',action='store_true',help='compute and store the metrics, no plots')
+    parser.add_argument('--shard',type=int,default=None,
+                        help='run only this shard of the jobs, writing to its own shard database (default $SLURM_ARRAY_TASK_ID)')
+    parser.add_argument('--shards',type=int,default=None,help='number of shards (default $SLURM_ARRAY_TASK_COUNT)')
+    parser.add_argument('--merge',action='store_true',
+                        help='fold the --shards shard databases of the run of these dates into the stats database and exit')
+    args=parser.parse_args()
+    if RESAMPLE_KM is not None and RESAMPLE_POINTS is not None:
+        parser.error('set RESAMPLE_KM or RESAMPLE_POINTS, not both')
+    
+    # sharded run: from the command line, or one Slurm array task each
+    shard,shards=args.shard,args.shards
+    if shard is None and 'SLURM_ARRAY_TASK_ID' in os.environ:
+        shard=int(os.environ['SLURM_ARRAY_TASK_ID'])-int(os.environ.get('SLURM_ARRAY_TASK_MIN',0))
+        shards=shards or int(os.environ['SLURM_ARRAY_TASK_COUNT'])
+    if args.merge:
+        if shards is None or args.shard is not None:
+            parser.error('--merge needs --shards (and no --shard)')
+    elif shards is not None and shard is None:
+        parser.error('--shards needs --shard, or a Slurm array task')
+    elif shard is not None and (shards is None or not 0 <= shard < shards):
+        parser.error('a shard needs 0 <= shard < shards')
+    
+    if len(args.dates)==0:
         n=datetime.now()-timedelta(1)  #yesterday
         theDate=datetime(n.year,n.month,n.day)
     else:
-        theDate=datetime.strptime(sys.argv[1],'%Y%m%d')
+        theDate=datetime.strptime(args.dates[0],'%Y%m%d')
+    endDate=datetime.strptime(args.dates[1],'%Y%m%d') if len(args.dates)>1 else theDate
+    if len(args.dates)>2 or endDate<theDate:
+        parser.error('give one date or a START END range')
+    backfill=len(args.dates)==2
+    
+    # merge step of a sharded run
+    if args.merge:
+        merged=merge_shards(shards,theDate,endDate)
+        if WANT_FRONTS:
+            front_store.compact(frontDir)
+        if WANT_STATS_PLOTS:
+            regions=load_regions()
+            write_block_dates(regions)
+            for (reg,region) in list(regions.items()):
+                plot_stats(region)
+                plot_skill(region)
+        sys.exit(0 if merged else 1)
         
-    print('Starting WBC Fronts at',datetime.now(),'for',theDate)
-
-    # set model directory (global)
-    modelDir='/scratch2/NCEPDEV/marine/Todd.Spindler/noscrub/Global/archive/'+theDate.strftime('%Y%m%d')
+    if args.metrics_only:
+        WANT_MAPS=False
+        WANT_STATS_PLOTS=False
+    if shard is not None:
+        # the stats plots wait for the merge step
+        WANT_STATS_PLOTS=False
+        print(f'shard {shard} of {shards}')
+        
+    print('Starting WBC Fronts at',datetime.now(),'for',theDate,'to',endDate if backfill else '')
         
     regions=load_regions()
     
-    # process navy frontal messages
-    navo=read_navo(f'{theDate:%Y}')
-    navoceano=read_navoceano(f'{theDate:%Y}')
+    # process navy frontal messages once for the whole range (decoded messages are cached, see read_navy.cacheDir)
+    navo,navoceano=load_navy(theDate,endDate)
 
-    if WANT_POOL:
-        pool=Pool(processes=maxjobs)
-            
-    FoundDate=False
+    # select the correct Navy source for frontal data
+    navies={}
     for (reg,region) in list(regions.items()):
-        print('region',reg)
-        # select the correct Navy source for frontal data
         if reg=='gulfstream':
-            navy=navo
+            navies[reg]=navo
         elif reg=='loopcurrent':
-            navy=navoceano
+            navies[reg]=navoceano
         elif reg=='kuroshio':
-            navy=navoceano
+            navies[reg]=navoceano
         elif reg=='azores':
-            navy=navoceano
-
-        if theDate not in navy[region['name'].upper()]:
-            print(theDate.strftime('%Y%m%d'),'not found -- skipping',reg)
-            continue
-        else:
-            FoundDate=True
+            navies[reg]=navoceano
+            
+    # a backfill skips the keys already in the dbase (unless forced) and the ones
+    # its checkpoint says are finished, so an interrupted backfill picks up where it stopped
+    checkpoint=None
+    done=set()
+    indb={reg:set() for reg in regions}
+    if backfill:
+        checkpoint=os.path.dirname(dbFile)+f'/backfill_{theDate:%Y%m%d}_{endDate:%Y%m%d}'+\
+            (f'_shard{shard}of{shards}' if shard is not None else '')+'.txt'
+        done=read_checkpoint(checkpoint)
+        if UPDATE_DB:
+            indb=existing_keys(regions,theDate,endDate)
+            
+    # a shard writes its rows to its own database (merged later with --merge),
+    # and counts the keys already there as done too
+    if shard is not None:
+        os.makedirs(shardDir,exist_ok=True)
+        dbFile=shard_file(shard,shards,theDate,endDate)
+        if backfill and UPDATE_DB:
+            for (reg,keys) in existing_keys(regions,theDate,endDate).items():
+                indb[reg]|=keys
+            
+    def skip(thedate,fcst,reg):
+        if not backfill:
+            return False
+        # finished (maps included) by this backfill before it stopped, unless
+        # its row didn't make it to the dbase
+        if checkpoint_key(thedate,fcst,reg) in done:
+            return not UPDATE_DB or (thedate,fcst) in indb[reg]
+        # a key in the dbase is done if its maps are drawn too (or not wanted)
+        if args.force or (thedate,fcst) not in indb[reg]:
+            return False
+        return not WANT_MAPS or maps_drawn(thedate,fcst,regions[reg])
+    
+    # single stats writer, started before the pools so the workers inherit its queue
+    # (and so do the Navy fronts, settings and the shared memory tracker)
+    if UPDATE_DB and WANT_POOL:
+        writer,stats_queue=stats_db.start_writer(dbFile)
         
-        # set your forecast range here
-        #for fcst in range(0,193,24):
-        for fcst in range(0,24,24):  # for testing, only does nowcast
-            print('fcst',fcst)
-            if WANT_POOL:
-                result=pool.apply_async(process_region,(region,fcst,navy,theDate))
-            else:
-                process_region(region,fcst,navy,theDate)
+    # everything that can fail while the writer runs, so it's always stopped
+    # (a writer left waiting on its queue would hang the interpreter at exit)
+    try:
+        if WANT_POOL:
+            navy_fronts.update(navies)
+            shared_fields.start_tracker()
+            # render: long-lived workers, so the base maps are reused.  Started
+            # first, so they fork before any pool's handler threads are running
+            render_pool=Pool(processes=renderjobs)
+            # compute: one task per worker process, so the peak memory reported is per task
+            pool=Pool(processes=maxjobs,initializer=limit_memory,initargs=(MEMORY_BUDGET,),maxtasksperchild=1)
+            jobs=Scheduler(pool,retries=RETRIES,delay=RETRY_DELAY,timeout=JOB_TIMEOUT)
+        
+            def queue_renders(key,shared):
+                for reg,item in shared.items():
+                    if item is None:
+                        mark_done(checkpoint,key[0],key[1],reg)
+                        continue
+                    # render jobs are not retried, their shared fields are gone after the first attempt
+                    jobs.submit(key+(reg,),render_shared,(item,),pool=render_pool,retries=0,
+                                callback=lambda key,result:mark_done(checkpoint,*key))
+            
+        # one job per date and forecast hour (FORECASTS), each reading the
+        # forecast's model files once for all of that date's active regions;
+        # jobs are queued date by date so a run's archive directory is read together
+        # (a shard takes every shards-th job of the full date x forecast list)
+        dates=pd.date_range(theDate,endDate,freq='D').to_pydatetime()
+        for (ndate,thedate) in enumerate(dates):
+            active=active_regions(regions,navies,thedate)
+            
+            for (nfcst,fcst) in enumerate(FORECASTS):
+                if shard is not None and (ndate*len(FORECASTS)+nfcst)%shards != shard:
+                    continue
+                todo={reg:region for (reg,region) in active.items() if not skip(thedate,fcst,reg)}
+                if not todo:
+                    continue
+                print('date',thedate.strftime('%Y%m%d'),'fcst',fcst)
+                if WANT_POOL:
+                    jobs.submit((thedate,fcst),compute_forecast,(todo,fcst,thedate),callback=queue_renders,
+                                cleanup=lambda key,shared:discard_shared(shared))
+                else:
+                    for reg in process_forecast(todo,fcst,navies,thedate):
+                        mark_done(checkpoint,thedate,fcst,reg)
                 
-    if WANT_POOL:
-        #finish up pool
-        print('closing pool')
-        pool.close()
-        print('waiting for workers to exit')
-        pool.join()
+        failed=[]
+        if WANT_POOL:
+            # wait for every compute and render job, retrying I/O failures
+            failed=jobs.wait()
+            print('jobs:',jobs.summary())
+            for key in failed:
+                print('failed job',key,repr(jobs.jobs[key]['error']))
+                # a failed render (or a render worker that died) leaves its block behind
+                if jobs.jobs[key]['func'] is render_shared:
+                    shared_fields.discard(jobs.jobs[key]['args'][0])
+            print('closing pools')
+            pool.close()
+            render_pool.close()
+            print('waiting for workers to exit')
+            pool.join()
+            render_pool.join()
+    finally:
+        if stats_queue is not None:
+            print('flushing stats')
+            stats_db.stop_writer(writer,stats_queue)
+        
+    # fold this run's front parts into the yearly store files (a shard
+    # leaves them to the merge step, so the shards don't race on them)
+    if WANT_FRONTS and shard is None:
+        front_store.compact(frontDir)
+        
+    # a finished backfill starts over next time
+    if checkpoint is not None and not failed and os.path.exists(checkpoint):
+        os.remove(checkpoint)
 
     # create stats plots only if some new data has been found
     if WANT_STATS_PLOTS:
+        write_block_dates(regions)
         for (reg,region) in list(regions.items()):
             plot_stats(region)
-                
+            plot_skill(region)
@@ -0,0 +1,129 @@
+"""
+On-disk cache of the regional RTOFS subsets that read_models extracts, so
+the maps or the metrics of a (region, run date, forecast) can be redone
+from a few MB instead of the five global files.
+
+Each entry is one compressed, chunked NetCDF4 file,
+cachedir/<region>_<YYYYMMDD run date>_<fcst>.nc, with the 2-D coordinates
+(lon, lat and the projected x, y) and the float32 fields temp, sst, ssh, u
+and v; masked points are stored as NaN.  current is recomputed from u and
+v on reading.  A tag string written with the entry (the region settings,
+map projection and temp clip window) must match on reading, or the entry is
+a miss.
+
+The cache is kept under a size cap by removing the least recently used
+files; a hit touches the file's mtime, as atime isn't reliable on
+noatime file systems.
+"""
+
+import glob
+import os
+import numpy as np
+import numpy.ma as ma
+import xarray as xr
+from datetime import datetime
+
+coords=['lon','lat','x','y']
+fields=['temp','sst','ssh','u','v']
+surface=['sst','ssh','u','v']  # fields that share one mask
+CHUNK=256      # chunk size along each grid dimension
+COMPLEVEL=4    # zlib compression level
+
+def cache_file(cachedir,reg,rundate,fcst):
+    return f'{cachedir}/{reg}_{rundate:%Y%m%d}_{fcst:03n}.nc'
+
+#-----------------------------------------------
+# read
+#-----------------------------------------------
+def read(cachedir,reg,rundate,fcst,tag=''):
+    """
+    the cached model dict of a region, run date and forecast, in the form
+    read_models returns, or None if it isn't cached (or the tag differs)
+    """
+    filename=cache_file(cachedir,reg,rundate,fcst)
+    if not os.path.exists(filename):
+        return None
+    try:
+        with xr.open_dataset(filename,decode_times=False) as nc:
+            if nc.attrs.get('tag','') != tag:
+                return None
+            model={key:nc[key].values for key in coords+fields}
+            vdate=datetime.strptime(nc.attrs['vdate'],'%Y%m%d%H')
+        os.utime(filename)
+    except (OSError,KeyError,ValueError) as err:
+        # evicted or being replaced by another worker
+        print('Unable to read model cache',filename,err)
+        return None
+
+    model['temp']=ma.masked_invalid(model['temp'],copy=False)
+    mask=np.zeros(model['sst'].shape,dtype=bool)
+    for key in surface:
+        mask|=np.isnan(model[key])
+    for key in surface:
+        model[key]=ma.array(model[key],mask=mask,copy=False)
+    model['current']=ma.array(np.hypot(model['u'].data,model['v'].data),mask=mask,copy=False)
+    model.update({'vdate':vdate,'rundate':rundate,'fcst':fcst})
+    return model
+
+#-----------------------------------------------
+# write
+#-----------------------------------------------
+def write(cachedir,reg,model,tag='',maxmb=None):
+    """
+    Cache a model dict from read_models (written atomically), then evict
+    down to maxmb.  I/O errors are reported, not raised, so a full disk
+    doesn't stop the run.
+    """
+    filename=cache_file(cachedir,reg,model['rundate'],model['fcst'])
+    tmpfile=f'{filename}.{os.getpid()}.tmp'
+    dims=('y','x')
+    chunks=tuple(min(n,CHUNK) for n in model['lon'].shape)
+    data={key:(dims,np.asarray(model[key])) for key in coords}
+    data.update({key:(dims,ma.filled(ma.asarray(model[key],dtype=np.float32),np.nan)) for key in fields})
+    ds=xr.Dataset(data,attrs={'tag':tag,'vdate':f'{model["vdate"]:%Y%m%d%H}'})
+    encoding={key:{'zlib':True,'complevel':COMPLEVEL,'shuffle':True,'chunksizes':chunks} for key in data}
+    try:
+        os.makedirs(cachedir,exist_ok=True)
+        ds.to_netcdf(tmpfile,engine='netcdf4',encoding=encoding)
+        os.replace(tmpfile,filename)
+    except (OSError,RuntimeError,ValueError) as err:
+        # netCDF4 reports HDF5 errors (e.g. a full disk) as RuntimeError
+        print('Unable to write model cache',filename,err)
+        try:
+            os.remove(tmpfile)
+        except FileNotFoundError:
+            pass
+        return
+    if maxmb is not None:
+        evict(cachedir,maxmb)
+
+#-----------------------------------------------
+# size cap
+#-----------------------------------------------
+def entries(cachedir):
+    """
+    [(mtime,bytes,filename)] of the cache files, least recently used first
+    """
+    items=[]
+    for filename in glob.glob(f'{cachedir}/*.nc'):
+        try:
+            stat=os.stat(filename)
+        except FileNotFoundError:
+            continue
+        items.append((stat.st_mtime,stat.st_size,filename))
+    return sorted(items)
+
+def evict(cachedir,maxmb):
+    """
+    remove the least recently used files until the cache is under maxmb
+    """
+    items=entries(cachedir)
+    total=sum([size for mtime,size,filename in items])
+    for mtime,size,filename in items:
+        if total <= maxmb*2**20:
+            break
+        try:
+            os.remove(filename)
+        except FileNotFoundError:
+            pass  # another worker got there first
+        total-=size
@@ -1,100 +1,215 @@
 import numpy
 import glob
-from datetime import datetime
+import os
+import zipfile
+from datetime import datetime, timedelta
 import pandas as pd
 #import pdb
 
 # DCOM location
 DCOMdir='/scratch2/NCEPDEV/marine/Todd.Spindler/noscrub/DCOM'
 
+# decoded message cache location (next to global_fronts.db), None to disable
+cacheDir='/scratch2/NCEPDEV/marine/Todd.Spindler/save/VPPPG/Global_RTOFS/EMC_ocean-verification/fronts/fix'
+
 #dataDir='/marine/noscrub/Todd.Spindler/Navy'
 hemisphere={'N':1,'S':-1,'E':1,'W':-1}
 
+# NAVO Gulf Stream message section headers
+northname='GULF STREAM NORTH WALL'
+southname='GULF STREAM SOUTH WALL'
+eomname='FRONTAL DATA BASED ON MAX'
+
 #----------------------------------------------------------------------------
 def parse_contents(front,header,contents):
-    front[header]={'lat':numpy.array([]),'lon':numpy.array([])}
+    """
+    Convert a list of NAVO position tokens (e.g. 35.2N74.9W) to lat/lon arrays
+    in one vectorized step
+    """
+    lat=numpy.array([token[:4] for token in contents],dtype=float)
+    lon=numpy.array([token[5:-1] for token in contents],dtype=float)
+    lat*=numpy.array([hemisphere[token[4]] for token in contents],dtype=float)
+    lon*=numpy.array([hemisphere[token[-1]] for token in contents],dtype=float)
+    front[header]={'lat':lat,'lon':lon}
+    return front
+
+#----------------------------------------------------------------------------
+def decode_navo(filename):
+    """
+    Single-pass decoder for one NAVO Gulf Stream bulletin.
+    Returns (date,{wall:[segment tokens]}) or (None,{}) if no wall headers
+    were found.  Repeated NORTH/SOUTH headers give one segment each, and exact
+    repeats of a segment are dropped.
+    """
+    with open(filename) as f:
+        contents=f.read().replace('\n','/').replace(':',' ').split('/')
 
-    for line in contents:
-        lat,lon=line[:5],line[5:]
-        front[header]['lat']=numpy.append(front[header]['lat'],float(lat[:-1])*hemisphere[lat[-1]])
-        front[header]['lon']=numpy.append(front[header]['lon'],float(lon[:-1])*hemisphere[lon[-1]])
+    thedate=None
+    walls={}
+    section=None
+    for token in contents:
+        token=token.strip()
+        if len(token)==0:
+            continue
+        if token.find(eomname)>=0:
+            break
+        if token.find(northname)>=0 or token.find(southname)>=0:
+            # sometimes north is first, sometimes south is first, sometimes
+            # south or north is missing, and sometimes there are two of one
+            name=northname if token.find(northname)>=0 else southname
+            if thedate is None:
+                thedate=datetime.strptime(''.join(token.split()[-3:]),'%d%b%y')
+            section=[]
+            walls.setdefault(name,[]).append(section)
+            continue
+        if section is not None:
+            section.extend(token.split())
+
+    for name,segments in walls.items():
+        unique=[]
+        for segment in segments:
+            if len(segment)>0 and segment not in unique:
+                unique.append(segment)
+        walls[name]=unique
+
+    return thedate,walls
+
+#----------------------------------------------------------------------------
+def parse_walls(walls):
+    """
+    Convert decode_navo() segments to lat/lon arrays, with a NaN break between
+    segments.  Both walls are always present, possibly empty.
+    """
+    front={}
+    for name in [northname,southname]:
+        lat,lon=[],[]
+        for segment in walls.get(name,[]):
+            if len(lat)>0:
+                lat.append([numpy.nan])  # put a break between segments
+                lon.append([numpy.nan])
+            wall=parse_contents({},name,segment)[name]
+            lat.append(wall['lat'])
+            lon.append(wall['lon'])
+        front=parse_contents(front,name,[])
+        if len(lat)>0:
+            front[name]={'lat':numpy.concatenate(lat),'lon':numpy.concatenate(lon)}
     return front
 
 #----------------------------------------------------------------------------
-def read_navo(year=f'{datetime.now():%Y}'):
+def decode_navo_walls(filename):
+    """
+    decode_navo() + parse_walls() for one bulletin, as (date,{wall:{'lat','lon'}})
+    """
+    thedate,walls=decode_navo(filename)
+    if thedate is None:
+        print('No wall headers found in '+filename)
+        return None,{}
+    return thedate,parse_walls(walls)
+
+#----------------------------------------------------------------------------
+def read_navo(year=f'{datetime.now():%Y}',start=None,end=None):
     """
     Decoder for the NAVO Gulf Stream Frontal Analysis text messages in /dcom
+    Only dates in [start,end] are returned if either is given.
     """
-    #pdb.set_trace()
-    northname='GULF STREAM NORTH WALL'
-    southname='GULF STREAM SOUTH WALL'
-    eomname='FRONTAL DATA BASED ON MAX'
-    
-    front={}
+    front={northname:{},southname:{}}
 
-    #year=datetime.now().strftime('%Y')
     # read in header and body
     #allfiles=glob.glob('/dcom/us007003/'+year+'*/wtxtbul/gs*.sub')
-    allfiles=glob.glob(f'{DCOMdir}/{year}*/wtxtbul/gs*.sub')
-    allfiles.sort()
+    allfiles=dcom_files(year,'gs*.sub',start,end)
+    if not allfiles:
+        return front
     
     # check the date.  NAVO seems to be a day ahead.
     latest=allfiles[-1]
-    latest_date=datetime.strptime(latest.split('/')[7],'%Y%m%d')
+    latest_date=datetime.strptime(latest.split('/')[-3],'%Y%m%d')
 
-    for nf,filename in enumerate(allfiles):
-        with open(filename) as f:
-            contents=f.read().replace('\n','/').replace(':',' ').split('/')
-            
-            # remove blank lines
-            contents=[token.strip() for token in contents if len(token.strip())>0]
-            
-            # split message into northwall and southwall parts    
-            if ' '.join(contents).find(eomname) >=0:                
-                [eom]=[nline for nline,line in enumerate(contents) if line.find(eomname) >=0]
-            if ' '.join(contents).find(northname) >=0:
-                [north]=[nline for nline,line in enumerate(contents) if line.find(northname) >=0]
-            else:
-                north=-999
-            if ' '.join(contents).find(southname) >=0:
-                [south]=[nline for nline,line in enumerate(contents) if line.find(southname) >=0]
-            else:
-                south=-999
-            # sometimes north is first, sometimes south is first, sometimes south or north is missing
-            # sometimes there are two norths or two souths.  Need to fix that rare case.
-            northwall=[]
-            southwall=[]
-            if north <= south:
-                if north != -999 and southwall != -999:
-                    northwall=contents[north+1:south]
-                    southwall=contents[south+1:eom]
-                elif south==-999:
-                    northwall=contents[north+1:eom]
-                elif north==-999:
-                    southwall=contents[south+1:eom]
-            else:
-                southwall=contents[south+1:north]
-                northwall=contents[north+1:eom]
-            thedate=datetime.strptime(''.join(contents[north].split()[-3:]),'%d%b%y')
-            thedate=min(latest_date,thedate) # in case there's an offset in the date    
-            if northname not in front:
-                front[northname]={thedate:{}}
-            if southname not in front:
-                front[southname]={thedate:{}}
-            northwall=' '.join(northwall).strip().split()
-            southwall=' '.join(southwall).strip().split()
-            front[northname]=parse_contents(front[northname],thedate,northwall)
-            front[southname]=parse_contents(front[southname],thedate,southwall)
-    
-    #dict_of_df = {k: pd.DataFrame(v) for k,v in front.items()}
-    #df = pd.concat(dict_of_df, axis=1)
+    for filename,thedate,walls in decode_files(allfiles,f'navo_{year}',decode_navo_walls):
+        if thedate is None:
+            continue
+        thedate=min(latest_date,thedate) # in case there's an offset in the date    
+        if not in_range(thedate,start,end):
+            continue
+        for name,wall in walls.items():
+            front[name][thedate]=wall
     
     return front
 
 #----------------------------------------------------------------------------
-def read_navoceano(year=f'{datetime.now():%Y}'):
+def parse_line(tokens):
+    """
+    Convert the lat/lon token pairs of one OVLY2 LINE (e.g. 3512N 07455W)
+    to lat/lon arrays in one vectorized step
+    """
+    lats,lons=tokens[0::2],tokens[1::2]
+    lat=numpy.array([token[:4] for token in lats],dtype=float)/100.
+    lon=numpy.array([token[:5] for token in lons],dtype=float)/100.
+    lat*=numpy.array([hemisphere[token[4]] for token in lats],dtype=float)
+    lon*=numpy.array([hemisphere[token[5]] for token in lons],dtype=float)
+    lon=numpy.where(lon < -180,lon%360,lon)
+    return lat,lon
+
+#----------------------------------------------------------------------------
+def decode_navoceano(filename):
+    """
+    Decoder for one NAVOCEANO OVLY2 message.  Walks the body with an index
+    cursor and returns (date,{name:{'lat','lon'}}), or (None,{}) if the header
+    fails the syntax check.  Lines are separated by NaN breaks.
+    """
+    with open(filename) as f:
+        contents=f.read().replace('\n','/').split('/')
+        
+    # remove blank lines
+    contents=[token.strip() for token in contents if len(token.strip())>0]
+    
+    # split message into header and body parts 
+    header,body=contents[:21],contents[21:]
+    
+    # basic header syntax check
+    if header[0] != 'APPROVED FOR PUBLIC RELEASE' or \
+        header[1] != 'UNCLAS' or \
+        header[3:6] != ['MSGID', 'NAVOCEANO', 'OVLY2'] or \
+        header[8] != 'OVLY' or \
+        header[13] != 'OCEAN FEATURE ANALYSIS':
+        print('Header syntax error in '+filename)
+        return None,{}
+    
+    # get the date from the header
+    thedate=datetime.strptime(header[-1].split()[-1],'%d%b%y')
+    
+    # begin parse cycle for body (TEXT + LINE + LINE)
+    lines={}
+    n=0
+    while n < len(body) and body[n] != 'ENDAT':
+        if body[n]=='ARC':
+            n+=7
+            continue
+        if body[n]=='TEXT':
+            name=body[n+6]
+            n+=7
+            if n < len(body) and body[n]=='LINE':
+                lines[name]={'lat':[],'lon':[]}
+            continue
+        if body[n]=='LINE':
+            npoints=int(body[n+1])
+            lat,lon=parse_line(body[n+4:n+4+2*npoints])
+            lines[name]['lat']+=[[numpy.nan],lat]  # put a break between lines
+            lines[name]['lon']+=[[numpy.nan],lon]
+            n+=4+2*npoints
+        else:
+            break
+
+    front={}
+    for name,line in lines.items():
+        front[name]={'lat':numpy.concatenate(line['lat']) if line['lat'] else numpy.array([]),
+                     'lon':numpy.concatenate(line['lon']) if line['lon'] else numpy.array([])}
+    return thedate,front
+
+#----------------------------------------------------------------------------
+def read_navoceano(year=f'{datetime.now():%Y}',start=None,end=None):
     """
     Decoder for the NAVOCEANO Ocean Frontal Analysis text message
+    Only dates in [start,end] are returned if either is given.
     """
     
     front={}
@@ -102,59 +217,127 @@ def read_navoceano(year=f'{datetime.now():%Y}'):
     #year=datetime.now().strftime('%Y')
     # read in header and body
     #allfiles=glob.glob('/dcom/us007003/'+year+'*/wtxtbul/*xx.mrf')
-    allfiles=glob.glob(f'{DCOMdir}/{year}*/wtxtbul/*xx.mrf')
-    allfiles.sort()
-    for filename in allfiles:
-        with open(filename) as f:
-            contents=f.read().replace('\n','/').split('/')
-            
-        # remove blank lines
-        contents=[token.strip() for token in contents if len(token.strip())>0]
-        
-        # split message into header and body parts 
-        header,body=contents[:21],contents[21:]
-        
-        # basic header syntax check
-        if header[0] != 'APPROVED FOR PUBLIC RELEASE' or \
-            header[1] != 'UNCLAS' or \
-            header[3:6] != ['MSGID', 'NAVOCEANO', 'OVLY2'] or \
-            header[8] != 'OVLY' or \
-            header[13] != 'OCEAN FEATURE ANALYSIS':
-            print('Header syntax error in '+filename)
-            return
-        
-        # get the date from the header
-        thedate=datetime.strptime(header[-1].split()[-1],'%d%b%y')
-        
-        # begin parse cycle for body (TEXT + LINE + LINE)
-        while len(body) > 0 and body[0] != 'ENDAT':
-            if body[0]=='ARC':
-                body=body[7:]
-                continue
-            if body[0]=='TEXT':
-                name,body=body[6],body[7:]
-                if name not in front:
-                    front[name]={}
-                if body[0]=='LINE':
-                    front[name][thedate]={'lat':numpy.array([]),'lon':numpy.array([])}
-                continue
-            if body[0]=='LINE':
-                front[name][thedate]['lat']=numpy.append(front[name][thedate]['lat'],numpy.nan)  # put a break between lines
-                front[name][thedate]['lon']=numpy.append(front[name][thedate]['lon'],numpy.nan)  # put a break between lines
-                npoints,body=int(body[1]),body[4:]
-                for np in range(npoints):
-                    lats,lons,body=body[0],body[1],body[2:]
-                    lat=float(lats[:4])/100.*hemisphere[lats[4]]
-                    lon=float(lons[:5])/100.*hemisphere[lons[5]]
-                    if lon < -180:
-                        lon=lon%360
-                    front[name][thedate]['lat']=numpy.append(front[name][thedate]['lat'],lat)
-                    front[name][thedate]['lon']=numpy.append(front[name][thedate]['lon'],lon)
-            else:
-                break
+    allfiles=dcom_files(year,'*xx.mrf',start,end)
+    for filename,thedate,lines in decode_files(allfiles,f'navoceano_{year}',decode_navoceano):
+        if thedate is None or not in_range(thedate,start,end):
+            continue
+        for name,line in lines.items():
+            if name not in front:
+                front[name]={}
+            front[name][thedate]=line
             
     return front
 
+#----------------------------------------------------------------------------
+def dcom_files(year,pattern,start=None,end=None,margin=7):
+    """
+    The year's DCOM messages matching pattern, sorted.  With start or end,
+    only the day directories within margin days of [start,end] are listed,
+    so a daily run stats a week of files instead of the whole year.
+    """
+    if start is None and end is None:
+        return sorted(glob.glob(f'{DCOMdir}/{year}*/wtxtbul/{pattern}'))
+    first=datetime(int(year),1,1)
+    last=datetime(int(year),12,31)
+    if start is not None:
+        first=max(first,start-timedelta(margin))
+    if end is not None:
+        last=min(last,end+timedelta(margin))
+    allfiles=[]
+    for day in pd.date_range(first,last,freq='D'):
+        allfiles+=glob.glob(f'{DCOMdir}/{day:%Y%m%d}/wtxtbul/{pattern}')
+    return sorted(allfiles)
+
+#----------------------------------------------------------------------------
+def in_range(thedate,start,end):
+    return (start is None or thedate >= start) and (end is None or thedate <= end)
+
+#----------------------------------------------------------------------------
+def load_cache(cachefile):
+    """
+    Read a decoded message cache written by save_cache().
+    Returns {filename:(size,mtime,date,{name:{'lat','lon'}})}, empty if
+    there is no cache or it can't be read (it is then rebuilt).
+    """
+    cache={}
+    if cachefile is None or not os.path.exists(cachefile):
+        return cache
+    try:
+        with numpy.load(cachefile) as npz:
+            files,sizes,mtimes,dates=npz['files'],npz['sizes'],npz['mtimes'],npz['dates']
+            rec_file,rec_name,offsets=npz['rec_file'],npz['rec_name'],npz['offsets']
+            lat,lon=npz['lat'],npz['lon']
+        for nf,filename in enumerate(files):
+            thedate=datetime.strptime(dates[nf],'%Y%m%d') if dates[nf] else None
+            cache[str(filename)]=(int(sizes[nf]),float(mtimes[nf]),thedate,{})
+        for nr,nf in enumerate(rec_file):
+            i0,i1=offsets[nr],offsets[nr+1]
+            cache[str(files[nf])][3][str(rec_name[nr])]={'lat':lat[i0:i1],'lon':lon[i0:i1]}
+    except (OSError,EOFError,KeyError,IndexError,ValueError,zipfile.BadZipFile) as err:
+        print('Unable to read message cache',cachefile,err,'-- rebuilding it')
+        return {}
+    return cache
+
+#----------------------------------------------------------------------------
+def save_cache(cachefile,cache):
+    """
+    Write the decoded message cache as one npz: a file table keyed by
+    path/size/mtime plus all fronts as concatenated lat/lon arrays with offsets
+    """
+    files=sorted(cache.keys())
+    rec_file,rec_name,lat,lon=[],[],[],[]
+    for nf,filename in enumerate(files):
+        for name,front in cache[filename][3].items():
+            rec_file.append(nf)
+            rec_name.append(name)
+            lat.append(front['lat'])
+            lon.append(front['lon'])
+    offsets=numpy.cumsum([0]+[len(l) for l in lat])
+    tmpfile=f'{cachefile}.{os.getpid()}.npz'  # per process, so concurrent runs don't share it
+    numpy.savez(tmpfile,
+        files=numpy.array(files,dtype=str),
+        sizes=numpy.array([cache[f][0] for f in files],dtype=numpy.int64),
+        mtimes=numpy.array([cache[f][1] for f in files],dtype=numpy.float64),
+        dates=numpy.array([f'{cache[f][2]:%Y%m%d}' if cache[f][2] else '' for f in files],dtype=str),
+        rec_file=numpy.array(rec_file,dtype=numpy.int32),
+        rec_name=numpy.array(rec_name,dtype=str),
+        offsets=offsets.astype(numpy.int64),
+        lat=numpy.concatenate(lat) if lat else numpy.array([]),
+        lon=numpy.concatenate(lon) if lon else numpy.array([]))
+    os.replace(tmpfile,cachefile)
+
+#----------------------------------------------------------------------------
+def decode_files(allfiles,cachename,decoder):
+    """
+    Decode messages with decoder(filename) -> (date,{name:{'lat','lon'}}),
+    reusing the cacheDir/navy_{cachename}.npz entries whose size and mtime
+    still match, so a daily run only decodes the new messages.  Entries of
+    files not in allfiles are kept.
+    Returns a list of (filename,date,fronts) in allfiles order.
+    """
+    cachefile=None if cacheDir is None else f'{cacheDir}/navy_{cachename}.npz'
+    cache=load_cache(cachefile)
+    
+    decoded=[]
+    changed=False
+    for filename in allfiles:
+        stat=os.stat(filename)
+        entry=cache.get(filename)
+        if entry is None or entry[0] != stat.st_size or entry[1] != stat.st_mtime:
+            thedate,fronts=decoder(filename)
+            entry=(stat.st_size,stat.st_mtime,thedate,fronts)
+            cache[filename]=entry
+            changed=True
+        decoded.append((filename,entry[2],entry[3]))
+
+    if changed and cachefile is not None:
+        try:
+            save_cache(cachefile,cache)
+        except OSError as err:
+            print('Unable to update message cache',cachefile,err)
+    
+    return decoded
+
 #----------------------------------------------------------------------------
 if __name__ == '__main__':
 	
@@ -0,0 +1,171 @@
+"""
+Job scheduler for the WBC fronts pools.
+Jobs go to multiprocessing pools with apply_async, and their outcome comes
+back to the main process through one event queue.  Every job is tracked
+(state, attempts, result, error and traceback); jobs that fail with a
+transient error (I/O errors from NetCDF/Lustre, by default) are
+resubmitted after a delay.  Callbacks of finished jobs run in the main
+process, inside wait(), so they can submit more jobs (the compute jobs
+queue their render jobs this way).
+
+A worker that dies (OOM killer, segfault) never reports back, so jobs
+can have a deadline: a job still running timeout seconds after it started
+fails with TimeoutError, which is transient (an OSError) and so retried.
+A late result of an attempt that timed out is handed to the job's cleanup
+instead of its callback.  So that a job's clock only runs while a worker
+has it, at most one job per pool worker is handed to a pool at a time; the
+rest stay pending in the scheduler, in the order they were submitted.
+"""
+
+import time
+import traceback
+import queue as queues
+
+# exceptions retried by default; the permanent ones win over the transient ones
+transient_errors=(OSError,)
+permanent_errors=(FileNotFoundError,PermissionError,MemoryError)
+
+class Scheduler:
+    """
+    jobs={key:{'state','attempts','result','error','traceback',...}},
+    where state is one of pending, running, retry, done or failed
+    """
+    def __init__(self,pool,retries=2,delay=30.,timeout=None,transient=transient_errors,permanent=permanent_errors):
+        self.pool=pool
+        self.retries=retries
+        self.delay=delay
+        self.timeout=timeout
+        self.transient=transient
+        self.permanent=permanent
+        self.jobs={}
+        self.events=queues.Queue()
+        self.waiting=[]  # (time,key) of jobs waiting to be retried
+        self.queued=[]   # keys of the pending jobs, waiting for a free worker
+        self.busy={}     # {id(pool):number of running jobs}
+
+    def submit(self,key,func,args=(),pool=None,callback=None,retries=None,timeout=None,cleanup=None):
+        """
+        Queue func(*args) on pool (default the scheduler's) as job key.
+        callback(key,result) is called from wait() when it succeeds, and
+        cleanup(key,result) for the result of an attempt that timed out.
+        retries and timeout default to the scheduler's.
+        """
+        self.jobs[key]={'func':func,'args':args,'pool':pool or self.pool,'callback':callback,'cleanup':cleanup,
+                        'retries':self.retries if retries is None else retries,
+                        'timeout':self.timeout if timeout is None else timeout,
+                        'state':'pending','attempts':0,'deadline':None,
+                        'result':None,'error':None,'traceback':None}
+        self.start(key)
+
+    def start(self,key):
+        self.jobs[key]['state']='pending'
+        self.queued.append(key)
+        self.dispatch()
+
+    def dispatch(self):
+        """
+        hand pending jobs to their pools while the pools have idle workers
+        """
+        for key in list(self.queued):
+            pool=self.jobs[key]['pool']
+            # Pool has no public size; _processes is the processes= it was made with
+            if self.busy.get(id(pool),0) < pool._processes:
+                self.queued.remove(key)
+                self.run(key)
+
+    def run(self,key):
+        job=self.jobs[key]
+        job['state']='running'
+        self.busy[id(job['pool'])]=self.busy.get(id(job['pool']),0)+1
+        job['attempts']+=1
+        attempt=job['attempts']
+        if job['timeout'] is not None:
+            job['deadline']=time.monotonic()+job['timeout']
+        job['pool'].apply_async(job['func'],job['args'],
+                                callback=lambda result:self.events.put((key,attempt,True,result)),
+                                error_callback=lambda err:self.events.put((key,attempt,False,err)))
+
+    def is_transient(self,err):
+        return isinstance(err,self.transient) and not isinstance(err,self.permanent)
+
+    def pending(self):
+        return [key for key,job in self.jobs.items() if job['state'] in ('pending','running','retry')]
+
+    def wait(self):
+        """
+        Process job events until every job is done or failed.  Returns the
+        keys of the failed jobs.
+        """
+        while True:
+            self.expire()
+            if not self.pending():
+                break
+            # wake up for the next retry or the next deadline
+            wakeups=[when for when,key in self.waiting]+\
+                [job['deadline'] for job in self.jobs.values() if job['state']=='running' and job['deadline'] is not None]
+            try:
+                key,attempt,ok,value=self.events.get(timeout=max(min(wakeups)-time.monotonic(),0) if wakeups else None)
+            except queues.Empty:
+                continue
+            job=self.jobs[key]
+            if attempt != job['attempts'] or job['state'] != 'running':
+                # an attempt that already timed out
+                if ok and job['cleanup'] is not None:
+                    job['cleanup'](key,value)
+                continue
+            self.release(key)
+            if ok:
+                job['state']='done'
+                job['result']=value
+                if job['callback'] is not None:
+                    job['callback'](key,value)
+            else:
+                self.fail(key,value)
+            self.dispatch()
+        return [key for key,job in self.jobs.items() if job['state']=='failed']
+
+    def release(self,key):
+        self.busy[id(self.jobs[key]['pool'])]-=1
+
+    def fail(self,key,err):
+        """
+        record a failed attempt, and queue a retry if the error is transient
+        """
+        job=self.jobs[key]
+        job['error']=err
+        # the worker's traceback comes back as the exception's cause
+        job['traceback']=''.join(traceback.format_exception(type(err),err,err.__traceback__))
+        if self.is_transient(err) and job['attempts'] <= job['retries']:
+            print(f'job {key} failed ({err!r}), retry {job["attempts"]} of {job["retries"]} in {self.delay:n} s')
+            job['state']='retry'
+            self.waiting.append((time.monotonic()+self.delay,key))
+        else:
+            print(f'job {key} failed after {job["attempts"]} attempt(s):\n{job["traceback"]}')
+            job['state']='failed'
+
+    def expire(self):
+        """
+        start the retries that are due, and fail the running jobs past their deadline
+        """
+        now=time.monotonic()
+        for when,key in [item for item in self.waiting if item[0] <= now]:
+            self.waiting.remove((when,key))
+            self.start(key)
+        for key,job in self.jobs.items():
+            if job['state']=='running' and job['deadline'] is not None and job['deadline'] <= now:
+                # a killed worker is replaced by the pool, so its slot is free again
+                self.release(key)
+                self.fail(key,TimeoutError(f'no result after {job["timeout"]:n} s (worker hung or killed?)'))
+        self.dispatch()
+
+    def summary(self):
+        """
+        one-line count of the jobs by state, and of the retried ones
+        """
+        states={}
+        for job in self.jobs.values():
+            states[job['state']]=states.get(job['state'],0)+1
+        retried=len([job for job in self.jobs.values() if job['attempts']>1])
+        if not states:
+            return 'no jobs'
+        return ', '.join([f'{count} {state}' for state,count in states.items()])+f', {retried} retried'
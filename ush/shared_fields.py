@@ -0,0 +1,134 @@
+"""
+Shared-memory hand-off of model fields between the WBC fronts compute and
+render pools.  A compute worker packs a region's arrays (masked arrays
+keep their mask, and masks shared between fields are stored once) into a
+single SharedMemory block with share(), and sends only the small
+descriptor through the pool.  The render worker maps the same block with
+attached() and unlinks it when it is done.
+"""
+
+import gc
+import numpy as np
+import numpy.ma as ma
+from contextlib import contextmanager
+from multiprocessing import resource_tracker, shared_memory
+
+ALIGN=64  # byte alignment of each array in the block
+
+#-----------------------------------------------
+# setup
+#-----------------------------------------------
+def start_tracker():
+    """
+    Start the shared memory resource tracker in the parent before the pools
+    fork, so every worker shares it.  Otherwise a compute worker starts its
+    own tracker, which unlinks the worker's blocks when the worker exits,
+    before the renderer gets to them.
+    """
+    resource_tracker.ensure_running()
+
+#-----------------------------------------------
+# compute side
+#-----------------------------------------------
+def share(arrays,meta=None):
+    """
+    Copy the dict of (masked) arrays into a new shared memory block.
+    Returns the picklable descriptor {'name','layout','masks','meta'},
+    where meta is passed through as is ({} by default).
+    """
+    layout={}
+    masks={}
+    mask_keys={}
+    offset=0
+    def place(key,data):
+        nonlocal offset
+        layout[key]=(offset,data.shape,data.dtype.str)
+        offset+=-(-data.nbytes//ALIGN)*ALIGN
+
+    for key,array in arrays.items():
+        place(key,np.asarray(ma.getdata(array)))
+        mask=ma.getmask(array)
+        if mask is ma.nomask:
+            continue
+        if id(mask) not in mask_keys:
+            mask_keys[id(mask)]=key+'_mask'
+            place(key+'_mask',mask)
+        masks[key]=mask_keys[id(mask)]
+
+    shm=shared_memory.SharedMemory(create=True,size=max(offset,1))
+    try:
+        for key,array in arrays.items():
+            start,shape,dtype=layout[key]
+            np.ndarray(shape,dtype,shm.buf,start)[...]=ma.getdata(array)
+            if masks.get(key)==key+'_mask':
+                start,shape,dtype=layout[key+'_mask']
+                np.ndarray(shape,dtype,shm.buf,start)[...]=ma.getmask(array)
+    except Exception:
+        shm.close()
+        shm.unlink()
+        raise
+    shm.close()
+    return {'name':shm.name,'layout':layout,'masks':masks,'meta':{} if meta is None else meta}
+
+def discard(shared):
+    """
+    unlink the block of a descriptor that won't be attached (its job failed
+    or was never run); a block already unlinked is ignored
+    """
+    try:
+        shm=shared_memory.SharedMemory(name=shared['name'])
+    except FileNotFoundError:
+        return
+    shm.close()
+    shm.unlink()
+
+#-----------------------------------------------
+# render side
+#-----------------------------------------------
+held=[]  # blocks whose arrays were still referenced at exit, closed later
+
+def release_held():
+    """
+    close the held blocks that are no longer referenced
+    """
+    for shm in list(held):
+        try:
+            shm.close()
+            held.remove(shm)
+        except BufferError:
+            pass
+
+@contextmanager
+def attached(shared):
+    """
+    Map the block of a share() descriptor and yield (arrays,meta), where
+    arrays is a dict of views of the shared memory (masked arrays where a
+    mask was shared).  On exit the dict is emptied and the block unlinked,
+    so each descriptor is attached once and nothing should keep the arrays.
+    """
+    release_held()
+    shm=shared_memory.SharedMemory(name=shared['name'])
+    arrays={}
+    try:
+        views={key:np.ndarray(shape,dtype,shm.buf,start)
+               for key,(start,shape,dtype) in shared['layout'].items()}
+        mask_keys=set(shared['masks'].values())
+        for key in views:
+            if key in shared['masks']:
+                arrays[key]=ma.array(views[key],mask=views[shared['masks'][key]],copy=False)
+            elif key not in mask_keys:
+                arrays[key]=views[key]
+        del views
+        yield arrays,shared['meta']
+    finally:
+        arrays.clear()
+        try:
+            shm.close()
+        except BufferError:
+            # still referenced (matplotlib artists are freed by the cycle collector)
+            gc.collect()
+            try:
+                shm.close()
+            except BufferError:
+                held.append(shm)
+        shm.unlink()
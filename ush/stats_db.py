@@ -0,0 +1,423 @@
+"""
+Stats database for the WBC fronts Hausdorff metrics.
+One table per region, one row per (date,forecast).  Rows are written in
+batches with executemany under WAL journaling, either directly with
+write_rows() or through a single writer process (start_writer) that the
+pool workers send their rows to.  The query functions at the bottom push
+the forecast and date-range filters into SQL, on indexed columns.
+
+Each region table also has a {table}_summary table of daily and weekly
+per-forecast aggregates, and the coverage table records which dates have
+rows.  Every write records the dates it touched in the dirty table, and
+flush_summaries recomputes just those days and weeks: write_rows does it
+in the same transaction, the writer process once when it stops.  connect()
+builds the summaries of databases written before they existed (once,
+recorded in PRAGMA user_version) and flushes what a writer that died left
+dirty.
+"""
+
+import sqlite3
+import sys
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+import time
+import queue as queues
+from multiprocessing import Process, Queue
+
+# metric columns in each region table, in table order
+# (the *_km columns are the geodesic metrics, NULL for regions without them)
+metric_columns=['haus_navy','modhaus_navy','quanthaus_navy','haus_km','modhaus_km','quanthaus_km']
+
+# summarized metric columns and summary periods (days per period)
+summary_metrics=['modhaus_navy','quanthaus_navy','modhaus_km','quanthaus_km']
+summary_periods={'day':1,'week':7}
+
+# PRAGMA user_version of a database whose summaries have been built
+SUMMARY_VERSION=1
+
+# tables that aren't region tables
+bookkeeping=['coverage','dirty']
+
+#------------------------
+# open the database
+#------------------------
+def connect(dbfile):
+    """
+    connection in WAL mode, so readers (plot_stats) never block the writer
+    """
+    conn = sqlite3.connect(dbfile,detect_types=sqlite3.PARSE_DECLTYPES,timeout=30.0)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    upgrade(conn)
+    return conn
+
+def region_tables(conn):
+    """
+    the region tables of a database (not the summaries or bookkeeping tables)
+    """
+    names=[row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")]
+    return [name for name in names if not name.endswith('_summary') and name not in bookkeeping]
+
+def upgrade(conn):
+    """
+    Build every summary and coverage row of a database older than
+    SUMMARY_VERSION, and flush the dates left dirty by a writer that
+    stopped early, before anything new is written.
+    """
+    def dirty():
+        return 'dirty' in [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")] and \
+            conn.execute('SELECT count(*) FROM dirty').fetchone()[0]>0
+    if conn.execute('PRAGMA user_version').fetchone()[0] >= SUMMARY_VERSION and not dirty():
+        return
+    # check again once holding the write lock, another process may have done it
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        if conn.execute('PRAGMA user_version').fetchone()[0] < SUMMARY_VERSION:
+            for table in region_tables(conn):
+                init_table(conn,table)
+                conn.execute('DELETE FROM '+table+'_summary')
+                conn.execute('DELETE FROM coverage WHERE region=?',(table,))
+                conn.executemany('INSERT OR IGNORE INTO dirty VALUES (?,?)',
+                                 [(table,row[0]) for row in conn.execute('SELECT DISTINCT date FROM '+table)])
+            conn.execute(f'PRAGMA user_version={SUMMARY_VERSION}')
+        if dirty():
+            flush_summaries(conn)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+#------------------------
+# initialize a table
+#------------------------
+def init_table(conn,table):
+
+    c = conn.cursor()
+
+    # Create table if needed
+    c.execute(
+        'CREATE TABLE IF NOT EXISTS '+table+' (date timestamp,'\
+                                           + ' forecast int,'\
+                                           + ''.join([f' {col} real,' for col in metric_columns])\
+                                           + ' unique(date,forecast))')
+
+    # add any metric columns missing from older tables
+    existing=[row[1] for row in c.execute('PRAGMA table_info('+table+')')]
+    for col in metric_columns:
+        if col not in existing:
+            c.execute('ALTER TABLE '+table+' ADD COLUMN '+col+' real')
+
+    # unique(date,forecast) already indexes date ranges, this one serves
+    # single-forecast queries (e.g. nowcast dates)
+    c.execute('CREATE INDEX IF NOT EXISTS '+table+'_forecast_date ON '+table+' (forecast,date)')
+
+    # per-forecast aggregates over each day and each week (starting Monday)
+    c.execute(
+        'CREATE TABLE IF NOT EXISTS '+table+'_summary (period text,'\
+                                                   + ' start timestamp,'\
+                                                   + ' forecast int,'\
+                                                   + ' metric text,'\
+                                                   + ' count int,'\
+                                                   + ' mean real,'\
+                                                   + ' median real,'\
+                                                   + ' q25 real,'\
+                                                   + ' q75 real,'\
+                                                   + ' q90 real,'\
+                                                   + ' unique(period,metric,start,forecast))')
+
+    # dates with rows, per region
+    c.execute('CREATE TABLE IF NOT EXISTS coverage (region text, date timestamp, forecasts int, nowcast int,'+\
+              ' unique(region,date))')
+
+    # dates written since their summaries were last computed
+    c.execute('CREATE TABLE IF NOT EXISTS dirty (region text, date timestamp, unique(region,date))')
+
+#-----------------------------------------------
+# database row for one result
+#-----------------------------------------------
+def make_row(thedate,fcst,metrics):
+    """
+    (date,forecast,metric columns...); metrics not computed are stored as NULL
+    """
+    return tuple([thedate,int(fcst)]+[None if metrics.get(col) is None else float(metrics[col])
+                                      for col in metric_columns])
+
+#-----------------------------------------------
+# write a batch of rows
+#-----------------------------------------------
+def write_rows(conn,rows,summarize=True):
+    """
+    REPLACE a list of (table,row) in one transaction, one executemany per
+    table, marking their dates dirty.  The summaries are flushed in the same
+    transaction unless summarize is False (the writer flushes once at the end).
+    """
+    tables={}
+    for table,row in rows:
+        tables.setdefault(table,[]).append(row)
+    with conn:
+        for table,trows in tables.items():
+            init_table(conn,table)
+            conn.executemany('REPLACE INTO '+table+' (date,forecast,'+','.join(metric_columns)+') '+\
+                             'VALUES ('+','.join(['?']*(2+len(metric_columns)))+')', trows)
+            conn.executemany('INSERT OR IGNORE INTO dirty VALUES (?,?)',[(table,d) for d in {row[0] for row in trows}])
+        if summarize:
+            flush_summaries(conn)
+
+#-----------------------------------------------
+# fold another stats database into this one
+#-----------------------------------------------
+def merge_db(conn,dbfile):
+    """
+    REPLACE every row of the region tables of dbfile (a shard database) into
+    conn in one transaction, summaries and coverage included.  Returns the
+    number of rows merged.
+    """
+    src=sqlite3.connect(dbfile,detect_types=sqlite3.PARSE_DECLTYPES,timeout=30.0)
+    rows=[]
+    for table in region_tables(src):
+        rows+=[(table,row) for row in src.execute('SELECT date,forecast,'+','.join(metric_columns)+' FROM '+table)]
+    src.close()
+    write_rows(conn,rows)
+    return len(rows)
+
+#-----------------------------------------------
+# summary tables
+#-----------------------------------------------
+def period_start(thedate,period):
+    """
+    start of the day or week (Monday) containing thedate
+    """
+    day=datetime(thedate.year,thedate.month,thedate.day)
+    if period=='week':
+        day-=timedelta(day.weekday())
+    return day
+
+def update_summaries(conn,table,dates):
+    """
+    Recompute the summary rows of every day and week containing one of the
+    dates, and their coverage rows, from the raw rows of those periods only
+    (read with one date-range query)
+    """
+    if len(dates)==0:
+        return
+    starts={period:sorted({period_start(thedate,period) for thedate in dates}) for period in summary_periods}
+    first=starts['week'][0]
+    last=starts['week'][-1]+timedelta(summary_periods['week'])
+    df=pd.read_sql_query('SELECT date, forecast, '+', '.join(summary_metrics)+' FROM '+table+\
+                         ' WHERE date >= ? AND date < ?',conn,params=(first,last))
+    df['date']=pd.to_datetime(df.date)
+    df['day']=df.date.dt.normalize()
+    df['week']=df.day-pd.to_timedelta(df.day.dt.weekday,unit='D')
+    
+    for period in summary_periods:
+        pdf=df[df[period].isin(starts[period])]
+        summary=[]
+        for metric in summary_metrics:
+            group=pdf.dropna(subset=[metric]).groupby([period,'forecast'])[metric]
+            if group.ngroups==0:
+                continue
+            stats=group.agg(['count','mean','median']).join(group.quantile([0.25,0.75,0.9]).unstack())
+            periods=stats.index.get_level_values(0).to_pydatetime()
+            fcsts=stats.index.get_level_values(1).astype(int).tolist()
+            summary+=[(period,start,fcst,metric,int(count),mean,median,q25,q75,q90)
+                      for start,fcst,(count,mean,median,q25,q75,q90) in
+                      zip(periods,fcsts,stats.itertuples(index=False,name=None))]
+        conn.executemany('DELETE FROM '+table+'_summary WHERE period=? AND start=?',
+                         [(period,start) for start in starts[period]])
+        conn.executemany('INSERT INTO '+table+'_summary VALUES (?,?,?,?,?,?,?,?,?,?)',summary)
+            
+    ddf=df[df.day.isin(starts['day'])]
+    covered=pd.DataFrame({'forecasts':ddf.groupby('day').forecast.nunique(),
+                          'nowcast':(ddf.forecast==0).groupby(ddf.day).any()})
+    conn.executemany('DELETE FROM coverage WHERE region=? AND date=?',[(table,day) for day in starts['day']])
+    conn.executemany('INSERT INTO coverage VALUES (?,?,?,?)',
+                     [(table,day,int(forecasts),int(nowcast)) for day,forecasts,nowcast in
+                      zip(covered.index.to_pydatetime(),covered.forecasts,covered.nowcast)])
+
+def flush_summaries(conn):
+    """
+    update the summaries of every dirty date (one update_summaries per
+    table) and clear the dirty table; run it inside a transaction
+    """
+    if len(existing_tables(conn,['dirty']))==0:
+        return
+    tables={}
+    for table,thedate in conn.execute('SELECT region,date FROM dirty'):
+        tables.setdefault(table,[]).append(pd.Timestamp(thedate).to_pydatetime())
+    for table,dates in tables.items():
+        update_summaries(conn,table,dates)
+    conn.execute('DELETE FROM dirty')
+
+#-----------------------------------------------
+# single writer process
+#-----------------------------------------------
+def writer_loop(dbfile,queue,batch=500,interval=5.0):
+    """
+    Collects (table,row) items from queue and writes them in batches of up to
+    batch rows, or whatever has arrived after interval seconds.  A None item
+    flushes and stops the writer.
+
+    A batch that fails (locked database, full disk, ...) is reported and
+    kept, and tried again with the next one, so the queue is still drained.
+    The writer exits with code 1 if rows are still unwritten at the end,
+    which stop_writer raises.
+    """
+    try:
+        conn=connect(dbfile)
+    except sqlite3.Error as err:
+        print('stats writer: unable to open',dbfile,err)
+        conn=None
+    rows=[]
+    done=False
+    while not done:
+        deadline=time.monotonic()+interval
+        count=0
+        while count < batch:
+            try:
+                item=queue.get(timeout=max(deadline-time.monotonic(),0.01))
+            except queues.Empty:
+                break
+            if item is None:
+                done=True
+                break
+            rows.append(item)
+            count+=1
+        if rows and conn is not None:
+            try:
+                write_rows(conn,rows,summarize=False)
+                rows=[]
+            except Exception as err:
+                print(f'stats writer: {len(rows)} rows not written yet ({err!r})')
+    if conn is not None:
+        # the summaries of everything written, once; if this fails the dates
+        # stay dirty and the next connect() flushes them
+        try:
+            with conn:
+                flush_summaries(conn)
+        except Exception as err:
+            print(f'stats writer: summaries left for the next run ({err!r})')
+        conn.close()
+    if rows or conn is None:
+        print('stats writer: rows lost, the stats database is incomplete')
+        sys.exit(1)
+
+def start_writer(dbfile,batch=500,interval=5.0):
+    """
+    Start the writer process.  Returns (process,queue); workers put
+    (table,row) items on the queue, see stop_writer.  The queue has to
+    reach the workers by inheritance (a global set before the Pool starts).
+    """
+    queue=Queue()
+    process=Process(target=writer_loop,args=(dbfile,queue,batch,interval))
+    process.start()
+    return process,queue
+
+def stop_writer(process,queue):
+    """
+    flush the remaining rows and wait for the writer to finish; raises
+    RuntimeError if the writer didn't write all of its rows
+    """
+    queue.put(None)
+    process.join()
+    if process.exitcode != 0:
+        raise RuntimeError(f'stats writer failed (exit code {process.exitcode}), rows are missing from the stats database')
+
+#-----------------------------------------------
+# queries
+#-----------------------------------------------
+def existing_tables(conn,tables):
+    """
+    the tables in the list that exist in the database
+    """
+    names=[row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")]
+    return [table for table in tables if table in names]
+
+def ensure_indexes(conn,tables):
+    """
+    bring older tables up to the current schema and indexes (their summaries
+    are built by connect)
+    """
+    tables=existing_tables(conn,tables)
+    with conn:
+        for table in tables:
+            init_table(conn,table)
+
+def nowcast_dates(conn,tables):
+    """
+    sorted distinct dates with a nowcast in any of the tables, from the coverage table
+    """
+    tables=existing_tables(conn,tables)
+    if len(tables)==0:
+        return pd.DatetimeIndex([])
+    df=pd.read_sql_query('SELECT DISTINCT date FROM coverage WHERE nowcast=1 AND region IN ('+\
+                         ','.join(['?']*len(tables))+') ORDER BY date',conn,params=tables)
+    return pd.DatetimeIndex(pd.to_datetime(df.date))
+
+def missing_dates(conn,tables):
+    """
+    days without a nowcast between the first and last nowcast dates
+    """
+    dates=nowcast_dates(conn,tables)
+    if len(dates)==0:
+        return dates
+    return pd.date_range(dates[0],dates[-1],freq='1D').difference(dates)
+
+def read_summary(conn,table,metric='quanthaus_navy',period='week',start=None,end=None):
+    """
+    summary rows (start, forecast, count, mean, median, q25, q75, q90) of one
+    metric and period, for start <= period start <= end
+    """
+    columns=['start','forecast','count','mean','median','q25','q75','q90']
+    if len(existing_tables(conn,[table+'_summary']))==0:
+        return pd.DataFrame(columns=columns)
+    where,params=['period=?','metric=?'],[period,metric]
+    if start is not None:
+        where.append('start >= ?')
+        params.append(pd.Timestamp(start).to_pydatetime())
+    if end is not None:
+        where.append('start <= ?')
+        params.append(pd.Timestamp(end).to_pydatetime())
+    df=pd.read_sql_query('SELECT '+', '.join(columns)+' FROM '+table+'_summary'+\
+                         ' WHERE '+' AND '.join(where)+' ORDER BY start, forecast',conn,params=params)
+    df['start']=pd.to_datetime(df.start)
+    return df
+
+def skill_curve(conn,table,metric='quanthaus_navy',start=None,end=None):
+    """
+    lead-time skill curve: count-weighted mean of a metric for each forecast
+    hour over the weeks starting in [start,end], from the weekly summaries
+    """
+    df=read_summary(conn,table,metric,'week',start,end)
+    df['total']=df['count']*df['mean']
+    curve=df.groupby('forecast')[['count','total']].sum()
+    curve['mean']=curve['total']/curve['count']
+    return curve[['count','mean']]
+
+def existing_keys(conn,table,start,end):
+    """
+    set of the (date,forecast) rows of one table with start <= date <= end
+    """
+    rows=conn.execute(f'SELECT date, forecast FROM {table} WHERE date >= ? AND date <= ?',
+                      (pd.Timestamp(start).to_pydatetime(),pd.Timestamp(end).to_pydatetime()))
+    return set([(date,forecast) for date,forecast in rows])
+
+def read_stats(conn,table,start=None,end=None,columns=('modhaus_navy','quanthaus_navy')):
+    """
+    date, forecast and the given columns of one table, for start <= date <= end
+    (either may be None), ordered by date and forecast
+    """
+    if len(existing_tables(conn,[table]))==0:
+        return pd.DataFrame(columns=['date','forecast']+list(columns))
+    where,params=[],[]
+    if start is not None:
+        where.append('date >= ?')
+        params.append(pd.Timestamp(start).to_pydatetime())
+    if end is not None:
+        where.append('date <= ?')
+        params.append(pd.Timestamp(end).to_pydatetime())
+    query='SELECT DISTINCT date, forecast, '+', '.join(columns)+' FROM '+table+\
+          (' WHERE '+' AND '.join(where) if where else '')+' ORDER BY date, forecast'
+    df=pd.read_sql_query(query,conn,params=params)
+    df['date']=pd.to_datetime(df.date)
+    return df